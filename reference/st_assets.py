@@ -0,0 +1,219 @@
+"""
+A local mirror of the media used as inputs by shaders.
+
+Shaders reference their textures, cubemaps, volumes, music and videos by
+filepath, and many shaders use the same few files. The mirror gathers the
+inputs of a batch of shaders, downloads every file it does not have yet
+once, on several threads, and stores it named after the SHA-256 hash of
+its content, so files with the same content under different paths are
+only stored once. Mirrored files are read through memory mapping.
+
+    root/
+        paths.json
+        blobs/<first 2 hash digits>/<hash>
+
+>>> from st_assets import AssetMirror
+>>> mirror = AssetMirror("assets")  # or AssetMirror("assets", transport=st_xapi.HTTPTransport())
+>>> mirror.mirror(session.get_shaders(shader_ids))
+{'fetched': 12, 'cached': 30, 'failed': [], 'bytes': 4194304}
+>>> with mirror.open("/media/a/52d2a8f514c4fd2d9866587f4d7b2a5bfa1a11a0e772077d7682deb8b3b517e5.jpg") as data:
+...     header = data[:16]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import mmap
+import os
+import threading
+
+# Input types whose filepath is a placeholder rather than a file to download
+GENERATED_INPUTS = {"buffer", "keyboard", "webcam", "mic", "musicstream"}
+
+def asset_paths(shaders):
+    """
+    Returns the sorted filepaths of the media used as inputs by shader dicts
+    or st_xapi.Shaders, each only once. The 6 faces of cubemaps are included.
+    """
+
+    paths = set()
+    for shader in shaders:
+        if shader is None:
+            continue
+
+        if not isinstance(shader, dict):
+            shader = shader.to_json()
+
+        for renderpass in shader.get("renderpass", []):
+            for shader_input in renderpass.get("inputs", []):
+                kind = shader_input.get("type", shader_input.get("ctype"))
+                path = shader_input.get("filepath", shader_input.get("src"))
+                if not path or kind in GENERATED_INPUTS:
+                    continue
+
+                paths.add(path)
+                if kind == "cubemap":
+                    stem, extension = os.path.splitext(path)
+                    paths.update(stem + "_" + str(face) + extension for face in range(1, 6))
+
+    return sorted(paths)
+
+class AssetMirror:
+    def __init__(self, root, base_url="https://www.shadertoy.com", transport=None):
+        """
+        root: directory of the mirror.
+        transport: thread safe object with a requests.Session compatible get()
+            method, e.g. an st_xapi.HTTPTransport, which files are downloaded
+            through. By default each thread has its own requests.Session.
+        """
+
+        self.root = root
+        self.base_url = base_url
+        self.transport = transport
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.sessions = []
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+
+        # Maps filepaths to the hashes of their content
+        self.index_path = os.path.join(root, "paths.json")
+        self.paths = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf-8") as f:
+                self.paths = json.load(f)
+
+    def __contains__(self, path):
+        return path in self.paths
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _fetch(self, path):
+        """ Downloads path into a blob, hashing it on the way. Returns its hash and size. """
+        transport = self.transport
+        if transport is None:
+            # requests.Session is not thread safe, so each thread has its own
+            if not hasattr(self.local, "session"):
+                import requests
+
+                self.local.session = requests.Session()
+                self.local.session.headers.update({"User-Agent": "shadertoy-client"})
+                with self.lock:
+                    self.sessions.append(self.local.session)
+
+            transport = self.local.session
+
+        url = path if "://" in path else self.base_url + path
+        temp_path = os.path.join(self.root, "blobs", "{}.{}.tmp".format(os.getpid(), threading.get_ident()))
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            response = transport.get(url, headers={"Referer": self.base_url + "/"}, stream=True)
+            try:
+                if not response.ok:
+                    raise ConnectionError("HTTP {} for {}".format(response.status_code, url))
+
+                with open(temp_path, "wb") as f:
+                    for chunk in response.iter_content(65536):
+                        digest.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+
+            finally:
+                response.close()
+
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+            raise
+
+        digest = digest.hexdigest()
+        blob_path = self._blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.replace(temp_path, blob_path)
+        return digest, size
+
+    def _save_index(self):
+        temp_path = "{}.{}.tmp".format(self.index_path, os.getpid())
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.paths, f)
+
+        os.replace(temp_path, self.index_path)
+
+    def mirror(self, shaders, workers=8):
+        """
+        Downloads the inputs of shader dicts or st_xapi.Shaders which are not
+        mirrored yet on up to workers threads. Returns a dict with the number
+        of files "fetched" and already "cached", the total "bytes" fetched and
+        the (filepath, exception) tuples of the downloads that "failed".
+        """
+
+        return self.mirror_paths(asset_paths(shaders), workers)
+
+    def mirror_paths(self, paths, workers=8):
+        """ Like mirror() but takes the filepaths to download. """
+        paths = list(paths)
+        missing = [path for path in dict.fromkeys(paths) if path not in self.paths]
+        report = {"fetched": 0, "cached": len(set(paths)) - len(missing), "failed": [], "bytes": 0}
+        if not missing:
+            return report
+
+        def fetch(path):
+            try:
+                return path, self._fetch(path), None
+            except Exception as e:
+                return path, None, e
+
+        with ThreadPoolExecutor(min(workers, len(missing))) as executor:
+            for path, result, error in executor.map(fetch, missing):
+                if error is not None:
+                    report["failed"].append((path, error))
+                    continue
+
+                with self.lock:
+                    self.paths[path] = result[0]
+
+                report["fetched"] += 1
+                report["bytes"] += result[1]
+
+        with self.lock:
+            self._save_index()
+
+        return report
+
+    def file_path(self, path):
+        """ Returns the path of the local copy of the file at filepath path. Raises KeyError if it is not mirrored. """
+        return self._blob_path(self.paths[path])
+
+    def open(self, path):
+        """
+        Returns a read-only mmap of the local copy of the file at filepath
+        path, which can be sliced like bytes and should be closed after use.
+        Raises KeyError if it is not mirrored.
+        """
+
+        with open(self.file_path(path), "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read(self, path):
+        """ Returns the content of the file at filepath path. Raises KeyError if it is not mirrored. """
+        # Empty files can't be mapped
+        if os.path.getsize(self.file_path(path)) == 0:
+            return b""
+
+        with self.open(path) as data:
+            return data[:]
+
+    def stats(self):
+        """ Returns a dict with the number of mirrored paths and blobs and the bytes the blobs take up. """
+        digests = set(self.paths.values())
+        return {
+            "paths": len(self.paths),
+            "blobs": len(digests),
+            "bytes": sum(os.path.getsize(self._blob_path(digest)) for digest in digests)
+        }
+
+    def close(self):
+        for session in self.sessions:
+            session.close()
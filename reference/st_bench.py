@@ -0,0 +1,161 @@
+"""
+Offline benchmarks of st_xapi against the local stand-in server in
+st_fakeserver. Each benchmark reports the number of items processed,
+the elapsed time and the throughput. The import benchmarks start up to
+20 interpreters each and time startup, comparing the lazy imports with
+creating the requests.Session.
+
+    python st_bench.py --latency 0.02 --count 2000 --workers 8
+    python st_bench.py --save baseline.json
+    python st_bench.py --compare baseline.json --tolerance 0.2
+
+With --compare the exit status is 1 if any benchmark is slower than the
+saved baseline by more than the tolerance.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+from st_fakeserver import FakeShadertoyServer
+from st_xapi import ShadertoySession, AsyncShadertoySession, HTTPTransport
+
+def bench_get_shaders(server, args):
+    """ Bulk get_shaders() of made up IDs. """
+    session = ShadertoySession(base_url=server.url)
+    shader_ids = [server.new_id() for _ in range(args.count)]
+    shaders, failures = session.get_shaders_bulk(shader_ids, args.batch_size, args.workers)
+    session.close()
+    return len(shaders) - sum(len(batch) for batch, _ in failures)
+
+def bench_get_shaders_http(server, args):
+    """ Bulk get_shaders() of made up IDs through HTTPTransport instead of requests. """
+    transport = HTTPTransport()
+    session = ShadertoySession(base_url=server.url, transport=transport)
+    shader_ids = [server.new_id() for _ in range(args.count)]
+    shaders, failures = session.get_shaders_bulk(shader_ids, args.batch_size, args.workers)
+    transport.close()
+    return len(shaders) - sum(len(batch) for batch, _ in failures)
+
+def _run_scripts(code, count):
+    """ Runs code in count new interpreters, one after the other. """
+    count = min(count, 20)
+    for _ in range(count):
+        subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+    return count
+
+def bench_import(server, args):
+    """ New interpreters importing st_xapi and using a helper, as short-lived scripts do. """
+    return _run_scripts("import st_xapi; st_xapi.ShadertoySession().get_embeddable_url('XslGRr')", args.count)
+
+def bench_import_requests(server, args):
+    """ Like import, but also creating the requests.Session as st_xapi used to on import. """
+    return _run_scripts("import st_xapi; st_xapi.ShadertoySession().session", args.count)
+
+def bench_get_comments(server, args):
+    """ Comment harvesting of count shaders with AsyncShadertoySession. """
+    async def harvest():
+        async with AsyncShadertoySession(args.workers, base_url=server.url) as session:
+            shader_ids = [server.new_id() for _ in range(args.count)]
+            return await asyncio.gather(*map(session.get_comments, shader_ids))
+
+    return len(asyncio.run(harvest()))
+
+def bench_get_comments_bulk(server, args):
+    """ get_comments_bulk() of count shaders. """
+    session = ShadertoySession(base_url=server.url)
+    changed, failures = session.get_comments_bulk([server.new_id() for _ in range(args.count)], args.workers)
+    session.close()
+    return len(changed)
+
+def bench_upload(server, args):
+    """ upload_shader() of count new shaders. """
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    shader = server.generate_shader("")
+    for _ in range(args.count):
+        session.upload_shader(shader)
+
+    session.close()
+    return args.count
+
+def bench_upload_batch(server, args):
+    """ upload_shaders() of count new shaders. """
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    shader = server.generate_shader("")
+    results = session.upload_shaders([{"shader_json": shader}] * args.count, args.workers)
+    session.close()
+    return sum(result["error"] is None for result in results)
+
+BENCHMARKS = {
+    "get_shaders": bench_get_shaders,
+    "get_shaders_http": bench_get_shaders_http,
+    "get_comments": bench_get_comments,
+    "get_comments_bulk": bench_get_comments_bulk,
+    "upload": bench_upload,
+    "upload_batch": bench_upload_batch,
+    "import": bench_import,
+    "import_requests": bench_import_requests
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark st_xapi against a local stand-in server.")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run, all by default: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--count", type=int, default=1000, help="items per benchmark")
+    parser.add_argument("--workers", type=int, default=8, help="parallel workers where supported")
+    parser.add_argument("--batch-size", type=int, default=50, help="shaders per get_shaders() request")
+    parser.add_argument("--latency", type=float, default=0.01, help="server latency in seconds")
+    parser.add_argument("--payload-size", type=int, default=2048, help="bytes of code per shader")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with HTTP 503")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--compare", help="compare results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown when comparing")
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark " + name)
+
+    results = {}
+    for name in args.benchmarks or BENCHMARKS:
+        with FakeShadertoyServer(latency=args.latency, payload_size=args.payload_size,
+                                 error_rate=args.error_rate) as server:
+            start = time.perf_counter()
+            items = BENCHMARKS[name](server, args)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "items": items,
+                "requests": server.requests,
+                "elapsed": elapsed,
+                "throughput": items / elapsed
+            }
+
+        print("{:<18} {:>7} items {:>7} requests {:>9.3f} s {:>10.1f} items/s".format(
+            name, items, server.requests, elapsed, items / elapsed
+        ))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        regressed = False
+        for name, result in results.items():
+            if name in baseline:
+                change = result["throughput"] / baseline[name]["throughput"] - 1
+                print("{:<18} {:+.1%} throughput vs baseline".format(name, change))
+                regressed |= change < -args.tolerance
+
+        if regressed:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
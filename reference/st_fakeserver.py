@@ -0,0 +1,420 @@
+"""
+A local stand-in for shadertoy.com implementing the endpoints used by
+st_xapi (/signin, /signout, /shadertoy, /comment and /myapps) with the
+same form fields, so that the client can be tested and benchmarked
+without touching the real site. Files under /media, playlist pages and
+the /myapps page are served too.
+
+Latency, the size of generated shaders and the rate of injected errors
+are configurable. Any requested shader ID that is not known yet is
+generated on the fly, so bulk fetches of made up IDs work. The same goes
+for media files, whose content is payload_size random bytes determined by
+the file name, so paths with the same file name have the same content.
+
+>>> from st_fakeserver import FakeShadertoyServer
+>>> server = FakeShadertoyServer(latency=0.02, error_rate=0.01)
+>>> server.start()
+>>> session = ShadertoySession(base_url=server.url)
+>>> session.signin(server.username, server.password)
+>>> server.stop()
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qsl
+import json
+import random
+import threading
+import time
+
+class FakeShadertoyServer:
+    def __init__(self, port=0, latency=0.0, payload_size=2048, error_rate=0.0, error_status=503,
+                 num_shaders=100, username="user", password="password"):
+        """
+        port: port to listen on, 0 picks a free one.
+        latency: seconds each request is delayed by.
+        payload_size: size in bytes of the code of generated shaders.
+        error_rate: fraction of requests answered with error_status instead.
+        num_shaders: number of shaders owned by the account.
+        """
+
+        self.latency = latency
+        self.payload_size = payload_size
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.username = username
+        self.password = password
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.next_id = 0
+
+        # Site state
+        self.tokens = set()
+        self.shaders = {}
+        self.owned = []
+        self.likes = set()
+        self.comments = {}
+        self.playlists = {}
+        self.following = set()
+        self.apps = {}
+        self.notifications = []
+        self.media = {}
+
+        for _ in range(num_shaders):
+            shader_id = self.new_id()
+            self.shaders[shader_id] = self.generate_shader(shader_id)
+            self.owned.append(shader_id)
+
+        handler = type("Handler", (FakeShadertoyHandler,), {"server_state": self})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.url = "http://127.0.0.1:" + str(self.httpd.server_address[1])
+        self.thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """ Serves requests on a background thread. """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def new_id(self):
+        """ Returns a new 6 character shader ID. """
+        with self.lock:
+            self.next_id += 1
+            number = self.next_id
+
+        chars = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+        shader_id = ""
+        for _ in range(6):
+            shader_id = chars[number % len(chars)] + shader_id
+            number //= len(chars)
+
+        return shader_id
+
+    def generate_shader(self, shader_id):
+        """ Returns a shader in the format returned by the site with about payload_size bytes of code. """
+        code = "void mainImage(out vec4 fragColor, in vec2 fragCoord)\n{\n"
+        line = "    fragColor = vec4(0.5 + 0.5 * cos(iTime + fragCoord.xyx / iResolution.xyx), 1.0);\n"
+        code += line * max(0, (self.payload_size - len(code) - 2) // len(line)) + "}\n"
+        return {
+            "ver": "0.1",
+            "info": {
+                "id": shader_id,
+                "date": str(1700000000 + len(self.shaders)),
+                "viewed": 0,
+                "name": "Shader " + shader_id,
+                "username": self.username,
+                "description": "Generated by st_fakeserver",
+                "likes": 0,
+                "published": 1,
+                "flags": 0,
+                "usePreview": 0,
+                "tags": ["test"],
+                "hasliked": 0,
+                "parentid": "",
+                "parentname": ""
+            },
+            "renderpass": [{
+                "inputs": [],
+                "outputs": [{"id": "4dfGRr", "channel": 0}],
+                "code": code,
+                "name": "Image",
+                "description": "",
+                "type": "image"
+            }]
+        }
+
+    def shader(self, shader_id):
+        with self.lock:
+            if shader_id not in self.shaders:
+                self.shaders[shader_id] = self.generate_shader(shader_id)
+
+            return self.shaders[shader_id]
+
+    def media_file(self, path):
+        """ Returns the content of the media file at path. """
+        with self.lock:
+            if path not in self.media:
+                self.media[path] = random.Random(path.rsplit("/", 1)[-1]).randbytes(self.payload_size)
+
+            return self.media[path]
+
+    def playlist_page(self, playlist_id, query):
+        """ Returns the HTML of a page of a playlist, or None if there is no such playlist. """
+        playlist = self.playlists.get(playlist_id)
+        if playlist is None:
+            return None
+
+        start = int(query.get("from", 0))
+        shader_ids = playlist["shaders"][start:start + int(query.get("num", 12))]
+        return (
+            "<html><head><title>" + playlist["name"] + "</title>\n"
+            "<script>\nvar gPlaylistID = \"" + playlist_id + "\";\n"
+            "var gShaderIDs = " + json.dumps(shader_ids) + ";\n</script></head>\n"
+            "<body><div id=\"playlist\"></div></body></html>"
+        )
+
+    def apps_page(self):
+        """ Returns the HTML of the myapps page. """
+        rows = "".join(
+            "<tr><td>" + app["name"] + "</td><td>" + app["description"] + "</td><td>" + key + "</td></tr>\n"
+            for key, app in self.apps.items()
+        )
+        return (
+            "<html><body><table id=\"appsTable\">\n"
+            "<tr><th>Name</th><th>Description</th><th>Key</th></tr>\n" + rows + "</table></body></html>"
+        )
+
+    def handle_shadertoy(self, form, signed_in):
+        if "gsibuifpt" in form:
+            if not signed_in:
+                return {"result": -3}
+
+            return {"result": 0, "shaderlist": {"id": list(self.owned)}}
+
+        if "a" in form or "u" in form or "f" in form:
+            if not signed_in:
+                return {"result": -3}
+
+            shader = json.loads(form.get("a") or form.get("u") or form.get("f"))
+            shader_id = shader["info"]["id"] if "u" in form else self.new_id()
+            shader["info"]["id"] = shader_id
+            with self.lock:
+                if shader_id not in self.shaders:
+                    self.owned.append(shader_id)
+
+                self.shaders[shader_id] = shader
+
+            return {"result": 0, "id": shader_id}
+
+        if "psg" in form:
+            ids = sorted(self.playlists)
+            return {"result": 0, "playlists": {
+                "id": ids,
+                "name": [self.playlists[i]["name"] for i in ids],
+                "system": [0 for i in ids],
+                "exists": [int(form["sid"] in self.playlists[i]["shaders"]) for i in ids]
+            }}
+
+        if "pas" in form or "prs" in form:
+            playlist = self.playlists.get(form["pid"])
+            if playlist is None or (form["sid"] in playlist["shaders"]) == ("pas" in form):
+                return {"result": -1}
+
+            if "pas" in form:
+                playlist["shaders"].append(form["sid"])
+            else:
+                playlist["shaders"].remove(form["sid"])
+
+            return {"result": 0}
+
+        if "pg" in form:
+            return {"result": 0, "playlists": [
+                {"id": i, "name": p["name"], "description": p["description"], "published": p["published"],
+                 "numshaders": len(p["shaders"])}
+                for i, p in self.playlists.items()
+            ]}
+
+        if "pa" in form:
+            playlist_id = self.new_id()
+            self.playlists[playlist_id] = {
+                "name": form["name"], "description": form["description"],
+                "published": int(form["published"]), "shaders": []
+            }
+            return {"result": 0, "id": playlist_id}
+
+        if "pu" in form:
+            playlist = self.playlists.get(form["pua"])
+            if playlist is None:
+                return {"result": -1}
+
+            playlist.update(name=form["name"], description=form["description"], published=int(form["published"]))
+            return {"result": 0}
+
+        if "pd" in form:
+            return {"result": 0 if self.playlists.pop(form["pda"], None) else -1}
+
+        if "ng" in form:
+            return {"result": 0, "notifications": self.notifications}
+
+        if "fcg" in form:
+            return {"result": 0, "following": sorted(self.following), "followers": []}
+
+        if "fs" in form or "fu" in form:
+            if ("fs" in form) == (form["uid"] in self.following):
+                return {"result": -1}
+
+            if "fs" in form:
+                self.following.add(form["uid"])
+            else:
+                self.following.discard(form["uid"])
+
+            return {"result": 0}
+
+        if "d" in form:
+            with self.lock:
+                if form["s"] not in self.owned:
+                    return -1
+
+                self.owned.remove(form["s"])
+                del self.shaders[form["s"]]
+
+            return 0
+
+        if "l" in form:
+            if form["l"] == "1":
+                self.likes.add(form["s"])
+            else:
+                self.likes.discard(form["s"])
+
+            return {"result": 0}
+
+        if "r" in form:
+            return {"result": 0}
+
+        # get_shaders(), nt/nl/np are accepted but every field is always included
+        return [self.shader(shader_id) for shader_id in json.loads(form["s"])["shaders"]]
+
+    def handle_comment(self, form, signed_in):
+        thread = self.comments.setdefault(form["s"], {
+            "text": [], "date": [], "username": [], "userpicture": [], "id": [], "hidden": []
+        })
+
+        if "comment" in form:
+            if not signed_in:
+                return {"added": -2}
+
+            thread["text"].append(form["comment"])
+            thread["date"].append(str(int(time.time())))
+            thread["username"].append(self.username)
+            thread["userpicture"].append("/img/profile.jpg")
+            thread["id"].append(self.new_id())
+            thread["hidden"].append(0)
+            return dict(thread, added=len(thread["id"]))
+
+        if "hide" in form:
+            if form["c"] not in thread["id"]:
+                return {"hide": 0}
+
+            thread["hidden"][thread["id"].index(form["c"])] = int(form["hide"])
+            return {"hide": 1}
+
+        return thread
+
+    def handle_myapps(self, form, signed_in):
+        if "a" in form:
+            if any(app["name"] == form["name"] for app in self.apps.values()):
+                return -2
+
+            self.apps[self.new_id()] = {"name": form["name"], "description": form["desc"]}
+            return 0
+
+        if "d" in form:
+            return 0 if self.apps.pop(form["id"], None) else -1
+
+        return -1
+
+class FakeShadertoyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_state = None
+
+    # Headers and body are written separately, don't let them wait on each other
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b"", content_type="application/json", headers=()):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server_state
+        with server.lock:
+            server.requests += 1
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        form = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+        path = urlparse(self.path).path
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send(server.error_status)
+
+        # Only the session token cookie matters
+        token = None
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "sdtd":
+                token = value
+
+        signed_in = token in server.tokens
+
+        if path == "/signin":
+            if form.get("user") != server.username or form.get("password") != server.password:
+                return self.send(302, headers=[("Location", "/signin?error=1")])
+
+            token = server.new_id() + server.new_id()
+            server.tokens.add(token)
+            return self.send(302, headers=[("Location", "/"), ("Set-Cookie", "sdtd=" + token + "; Path=/")])
+
+        if path == "/signout":
+            server.tokens.discard(token)
+            return self.send(302, headers=[("Location", "/"), ("Set-Cookie", "sdtd=; Path=/; Max-Age=0")])
+
+        handler = {
+            "/shadertoy": server.handle_shadertoy,
+            "/comment": server.handle_comment,
+            "/myapps": server.handle_myapps
+        }.get(path)
+
+        if handler is None:
+            return self.send(404)
+
+        self.send(200, json.dumps(handler(form, signed_in)).encode("utf-8"))
+
+    def do_GET(self):
+        server = self.server_state
+        url = urlparse(self.path)
+        path = url.path
+        if not path.startswith(("/media/", "/playlist/", "/myapps")):
+            # Landing page for redirects
+            return self.send(200, b"<html></html>", "text/html")
+
+        with server.lock:
+            server.requests += 1
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send(server.error_status)
+
+        if path.startswith("/media/"):
+            return self.send(200, server.media_file(path), "application/octet-stream")
+
+        if path == "/myapps":
+            return self.send(200, server.apps_page().encode("utf-8"), "text/html")
+
+        page = server.playlist_page(path[len("/playlist/"):], dict(parse_qsl(url.query)))
+        if page is None:
+            return self.send(404)
+
+        self.send(200, page.encode("utf-8"), "text/html")
@@ -0,0 +1,205 @@
+"""
+A local search index over shaders fetched with st_xapi.
+
+Shaders are indexed by name, tags, username, description and the GLSL
+identifiers used in their render passes. Queries return shader IDs
+ranked with BM25, where matches in the name count for more than matches
+in the code. Shaders can be added, replaced and removed at any time.
+
+>>> from st_index import ShaderIndex
+>>> index = ShaderIndex()
+>>> index.add_shaders(session.get_shaders(shader_ids))
+>>> index.search("raymarched clouds")
+['XslGRr', '4dSGW1', ...]
+>>> index.search("sdBox", field="code")
+>>> index.save("shaders.idx")
+>>> index = ShaderIndex.load("shaders.idx")
+"""
+
+import gzip
+import heapq
+import json
+import math
+import re
+
+# How much a match in each field counts for
+FIELD_WEIGHTS = {
+    "name": 4.0,
+    "tags": 3.0,
+    "username": 2.0,
+    "description": 1.0,
+    "code": 0.5
+}
+
+# Identifiers in nearly every shader, which would only add noise
+GLSL_STOPWORDS = {
+    "void", "bool", "int", "uint", "float", "double", "vec2", "vec3", "vec4", "ivec2", "ivec3", "ivec4",
+    "uvec2", "uvec3", "uvec4", "bvec2", "bvec3", "bvec4", "mat2", "mat3", "mat4", "sampler2d", "samplercube",
+    "const", "in", "out", "inout", "uniform", "return", "if", "else", "for", "while", "do", "break",
+    "continue", "discard", "struct", "true", "false", "define", "ifdef", "ifndef", "endif", "include",
+    "main", "mainimage", "fragcolor", "fragcoord", "iresolution", "itime", "x", "y", "z", "w", "xy",
+    "xyz", "rgb", "rgba", "uv", "col", "p", "i", "j", "k", "t", "d", "a", "b", "c", "r", "g"
+}
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# Splits identifiers at underscores, camelCase humps and digits
+PART_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+def tokenize_text(text):
+    """ Returns the lowercase words of text. """
+    return WORD_PATTERN.findall(text.lower())
+
+def tokenize_code(code):
+    """
+    Returns the tokens of the GLSL identifiers in code, each identifier
+    in full and split into its parts, e.g. sdRoundBox gives sdroundbox,
+    sd, round and box. Common keywords and built-in names are dropped.
+    """
+
+    tokens = []
+    for identifier in IDENTIFIER_PATTERN.findall(code):
+        lowered = identifier.lower()
+        if lowered in GLSL_STOPWORDS:
+            continue
+
+        tokens.append(lowered)
+        parts = PART_PATTERN.findall(identifier)
+        if len(parts) > 1:
+            tokens += [part.lower() for part in parts if part.lower() not in GLSL_STOPWORDS]
+
+    return tokens
+
+def shader_fields(shader):
+    """ Returns a dict mapping field names to the text of a shader dict or st_xapi.Shader. """
+    if isinstance(shader, dict):
+        info = shader["info"]
+        code = [renderpass.get("code", "") for renderpass in shader.get("renderpass", [])]
+    else:
+        info = shader.info
+        code = [renderpass.code or "" for renderpass in shader.passes]
+
+    return {
+        "name": info.get("name", ""),
+        "tags": " ".join(info.get("tags", [])),
+        "username": info.get("username", ""),
+        "description": info.get("description", ""),
+        "code": "\n".join(code)
+    }
+
+class ShaderIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        """ k1 and b are the BM25 term frequency saturation and length normalization parameters. """
+        self.k1 = k1
+        self.b = b
+
+        # Maps shader IDs to {field: {token: count}}
+        self.documents = {}
+
+        # Maps field names to {token: {shader ID: count}}
+        self.postings = {field: {} for field in FIELD_WEIGHTS}
+
+        # Maps field names to the total number of tokens in that field
+        self.total_lengths = dict.fromkeys(FIELD_WEIGHTS, 0)
+        self.lengths = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, shader_id):
+        return shader_id in self.documents
+
+    def add(self, shader):
+        """ Adds a shader dict or st_xapi.Shader, replacing any earlier version of it. """
+        info = shader["info"] if isinstance(shader, dict) else shader.info
+        fields = shader_fields(shader)
+        document = {}
+        for field, text in fields.items():
+            counts = {}
+            for token in (tokenize_code(text) if field == "code" else tokenize_text(text)):
+                counts[token] = counts.get(token, 0) + 1
+
+            document[field] = counts
+
+        self._insert(info["id"], document)
+
+    def add_shaders(self, shaders):
+        """ Adds every shader of an iterable, e.g. the result of get_shaders(). """
+        for shader in shaders:
+            if shader is not None:
+                self.add(shader)
+
+    def _insert(self, shader_id, document):
+        self.remove(shader_id)
+        self.documents[shader_id] = document
+        self.lengths[shader_id] = {}
+        for field, counts in document.items():
+            postings = self.postings[field]
+            for token, count in counts.items():
+                postings.setdefault(token, {})[shader_id] = count
+
+            length = sum(counts.values())
+            self.lengths[shader_id][field] = length
+            self.total_lengths[field] += length
+
+    def remove(self, shader_id):
+        """ Removes a shader from the index if it is in it. """
+        document = self.documents.pop(shader_id, None)
+        if document is None:
+            return
+
+        for field, counts in document.items():
+            postings = self.postings[field]
+            for token in counts:
+                del postings[token][shader_id]
+                if not postings[token]:
+                    del postings[token]
+
+            self.total_lengths[field] -= self.lengths[shader_id][field]
+
+        del self.lengths[shader_id]
+
+    def search(self, query, limit=20, field=None):
+        """
+        Returns up to limit shader IDs matching any word of query, best
+        matches first. field restricts the search to one field.
+        """
+
+        if not self.documents:
+            return []
+
+        tokens = set(tokenize_text(query)) | set(tokenize_code(query))
+        scores = {}
+        for name in [field] if field else FIELD_WEIGHTS:
+            postings = self.postings[name]
+            average_length = self.total_lengths[name] / len(self.documents) or 1
+            for token in tokens:
+                matches = postings.get(token)
+                if not matches:
+                    continue
+
+                idf = math.log(1 + (len(self.documents) - len(matches) + 0.5) / (len(matches) + 0.5))
+                for shader_id, count in matches.items():
+                    norm = 1 - self.b + self.b * self.lengths[shader_id][name] / average_length
+                    score = FIELD_WEIGHTS[name] * idf * count * (self.k1 + 1) / (count + self.k1 * norm)
+                    scores[shader_id] = scores.get(shader_id, 0) + score
+
+        return heapq.nlargest(limit, scores, key=scores.get)
+
+    def save(self, path):
+        """ Saves the index to a gzipped JSON file. """
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "documents": self.documents}, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        """ Loads an index saved with save(). """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+
+        index = cls(state["k1"], state["b"])
+        for shader_id, document in state["documents"].items():
+            index._insert(shader_id, document)
+
+        return index
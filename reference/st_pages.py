@@ -0,0 +1,79 @@
+"""
+Streaming parser for the HTML pages of shadertoy.com which st_xapi scrapes,
+such as playlists and the apps table, for data the JSON endpoints do not
+return. It is kept apart from st_xapi so that scripts which never scrape a
+page don't pay for importing html.parser.
+
+>>> from st_pages import PageParser
+>>> parser = PageParser(["gShaderIDs"])
+>>> parser.feed(html)
+>>> parser.close()
+>>> parser.arrays["gShaderIDs"]
+['XsX3RB', 'Md23DV']
+"""
+
+from html.parser import HTMLParser
+import re
+
+class PageParser(HTMLParser):
+    """
+    Streaming parser of shadertoy pages, keeping only the strings in the
+    JavaScript arrays assigned to the variables named in variables, in
+    arrays, and the cell texts of table rows, in header and rows. A row is
+    the header if it is in a thead or all its cells are th. Only the
+    script or table row being received is buffered.
+    """
+
+    def __init__(self, variables=()):
+        super().__init__()
+        self.patterns = {name: re.compile(r"\b" + name + r"\s*=\s*\[(.*?)\]", re.DOTALL) for name in variables}
+        self.arrays = {}
+        self.header = []
+        self.rows = []
+        self.script = None
+        self.row = None
+        self.cell = None
+        self.in_thead = False
+        self.all_th = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "script":
+            self.script = []
+        elif tag == "thead":
+            self.in_thead = True
+        elif tag == "tr":
+            self.row = []
+            self.all_th = True
+        elif tag in ("td", "th") and self.row is not None:
+            self.cell = []
+            self.all_th &= tag == "th"
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self.script is not None:
+            script = "".join(self.script)
+            self.script = None
+            for name, pattern in self.patterns.items():
+                match = pattern.search(script)
+                if match:
+                    self.arrays[name] = re.findall(r"[\"']([^\"']*)[\"']", match.group(1))
+
+        elif tag in ("td", "th") and self.cell is not None:
+            self.row.append(" ".join("".join(self.cell).split()))
+            self.cell = None
+
+        elif tag == "thead":
+            self.in_thead = False
+
+        elif tag == "tr" and self.row is not None:
+            if self.row and (self.in_thead or self.all_th):
+                self.header = self.row
+            else:
+                self.rows.append(self.row)
+
+            self.row = None
+
+    def handle_data(self, data):
+        if self.script is not None:
+            self.script.append(data)
+        elif self.cell is not None:
+            self.cell.append(data)
@@ -0,0 +1,339 @@
+"""
+Static pre-screening of shaders for the risk of hanging or crashing WebGL.
+
+Shaders are never compiled or run. Instead the code and inputs of every
+render pass are inspected for what tends to take down a browser tab:
+loops with huge or unbounded iteration counts, many passes, buffers that
+feed back into themselves, very long code and unusual inputs. Each of
+these adds to a risk score from 0 to 100 along with a short reason.
+
+Scoring runs on a pool of processes, so thousands of shaders a minute can
+be screened. Scores are cached by a hash of the passes, so shaders that
+are fetched again, or forks which did not change the code, are not
+screened twice.
+
+>>> from st_prescreen import prescreen, ScoreCache, RISK_THRESHOLD
+>>> cache = ScoreCache("scores.db")
+>>> for shader_id, result in prescreen(session.get_shaders(shader_ids), cache):
+...     if result["score"] >= RISK_THRESHOLD:
+...         print(shader_id, result["reasons"])
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+
+# Shaders scoring this much or more are best not run without a warning
+RISK_THRESHOLD = 50
+
+# Input types which are rare and either heavy or need hardware access
+UNUSUAL_INPUTS = {"video", "webcam", "mic", "musicstream", "volume"}
+
+FOR_PATTERN = re.compile(r"\bfor\s*\(([^;]*);([^;]*);([^)]*)\)")
+WHILE_PATTERN = re.compile(r"\bwhile\b")
+DEFINE_PATTERN = re.compile(r"#\s*define\s+(\w+)\s+\(?\s*([0-9.]+)")
+CONST_PATTERN = re.compile(r"\bconst\s+(?:int|uint|float)\s+(\w+)\s*=\s*([0-9.]+)")
+BOUND_PATTERN = re.compile(r"(\w+)\s*(<=?|>=?|!=)\s*([\w.]+)")
+START_PATTERN = re.compile(r"(\w+)\s*=\s*([0-9.]+)\s*$")
+STEP_PATTERN = re.compile(r"^\s*(?:(\w+)\s*(?:\+\+|--)|(?:\+\+|--)\s*(\w+)|(\w+)\s*[-+]=\s*([\w.]+)|(\w+)\s*=\s*(\w+)\s*[-+]\s*([\w.]+))\s*$")
+COMMENT_PATTERN = re.compile(r"//[^\n]*|/\*.*?\*/", re.DOTALL)
+
+def _number(text, constants):
+    """ Returns the value of a literal or a constant defined in the code, or None. """
+    text = constants.get(text, text).rstrip("uUfF")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+def _body_end(code, start):
+    """ Returns the index at which the loop whose header ends at start ends. """
+    depth = 0
+    index = start
+    while index < len(code):
+        char = code[index]
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                break
+
+        index += 1
+
+    body = index + 1
+    while body < len(code) and code[body].isspace():
+        body += 1
+
+    if code[body:body + 1] != "{":
+        end = code.find(";", body)
+        return len(code) if end < 0 else end
+
+    depth = 0
+    for index in range(body, len(code)):
+        if code[index] == "{":
+            depth += 1
+        elif code[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+
+    return len(code)
+
+def _step(text, name, constants):
+    """ Returns by how much the increment of a for loop changes the variable name, or None if it is not constant. """
+    match = STEP_PATTERN.match(text)
+    if not match:
+        return None
+
+    if match.group(1) or match.group(2):
+        return 1 if name in (match.group(1), match.group(2)) else None
+
+    if match.group(3) == name:
+        return _number(match.group(4), constants)
+
+    if match.group(5) == name and match.group(6) == name:
+        return _number(match.group(7), constants)
+
+    return None
+
+def analyze_code(code):
+    """
+    Returns a dict describing the loops of a pass's GLSL code:
+    "iterations": the largest number of iterations of a nest of for loops
+        with constant bounds, multiplied together.
+    "dynamic": the number of for loops whose bounds are not constant.
+    "while": the number of while and do-while loops.
+    """
+
+    code = COMMENT_PATTERN.sub("", code)
+    constants = dict(DEFINE_PATTERN.findall(code))
+    constants.update(CONST_PATTERN.findall(code))
+
+    loops = []
+    dynamic = 0
+    for match in FOR_PATTERN.finditer(code):
+        count = None
+        start = START_PATTERN.search(match.group(1))
+        bound = BOUND_PATTERN.search(match.group(2))
+        if start and bound and bound.group(1) == start.group(1):
+            first = _number(start.group(2), constants)
+            last = _number(bound.group(3), constants)
+            if first is not None and last is not None:
+                count = abs(last - first)
+                step = _step(match.group(3), start.group(1), constants)
+                if step:
+                    count /= abs(step)
+
+                count = max(1, count)
+
+        if count is None:
+            dynamic += 1
+            count = 1
+
+        loops.append((match.start(), _body_end(code, match.start()), count))
+
+    # Multiply the iterations of every loop by those of the loops it is nested in
+    iterations = 0
+    for start, end, count in loops:
+        total = count
+        for outer_start, outer_end, outer_count in loops:
+            if outer_start < start and end <= outer_end:
+                total *= outer_count
+
+        iterations = max(iterations, total)
+
+    return {"iterations": int(iterations), "dynamic": dynamic, "while": len(WHILE_PATTERN.findall(code))}
+
+def _feedback(passes):
+    """ Returns the number of passes reading their own output and the number in longer cycles. """
+    writers = {}
+    for index, renderpass in enumerate(passes):
+        for output in renderpass.get("outputs", []):
+            writers[output["id"]] = index
+
+    reads = [
+        {writers[shader_input["id"]] for shader_input in renderpass.get("inputs", []) if shader_input["id"] in writers}
+        for renderpass in passes
+    ]
+
+    own = sum(index in read for index, read in enumerate(reads))
+    cyclic = 0
+    for index in range(len(passes)):
+        # Follow what the pass reads until it comes back to the pass
+        seen = set()
+        stack = [other for other in reads[index] if other != index]
+        while stack:
+            other = stack.pop()
+            if other == index:
+                cyclic += 1
+                break
+
+            if other not in seen:
+                seen.add(other)
+                stack += reads[other]
+
+    return own, cyclic
+
+def score_passes(passes):
+    """
+    Returns a dict with the risk "score" from 0 to 100 of a shader with the
+    given render passes and the "reasons" adding to it.
+    """
+
+    score = 0
+    reasons = []
+
+    def add(points, reason):
+        nonlocal score
+        score += points
+        reasons.append(reason)
+
+    iterations = 0
+    dynamic = 0
+    unbounded = 0
+    size = 0
+    for renderpass in passes:
+        code = renderpass.get("code", "")
+        size += len(code)
+        loops = analyze_code(code)
+        iterations = max(iterations, loops["iterations"])
+        dynamic += loops["dynamic"]
+        unbounded += loops["while"]
+
+    if iterations > 1000000:
+        add(40, "loops run {} times".format(iterations))
+    elif iterations > 100000:
+        add(25, "loops run {} times".format(iterations))
+    elif iterations > 10000:
+        add(10, "loops run {} times".format(iterations))
+
+    if dynamic:
+        add(min(30, 15 * dynamic), "{} loops with non-constant bounds".format(dynamic))
+
+    if unbounded:
+        add(min(20, 10 * unbounded), "{} while loops".format(unbounded))
+
+    if len(passes) > 2:
+        add(min(20, 5 * (len(passes) - 2)), "{} passes".format(len(passes)))
+
+    own, cyclic = _feedback(passes)
+    if own:
+        add(min(10, 5 * own), "{} buffers reading their own output".format(own))
+
+    if cyclic:
+        add(min(20, 10 * cyclic), "{} buffers in feedback cycles".format(cyclic))
+
+    if size > 50000:
+        add(20, "{} characters of code".format(size))
+    elif size > 20000:
+        add(10, "{} characters of code".format(size))
+
+    unusual = sorted({
+        shader_input.get("type", shader_input.get("ctype"))
+        for renderpass in passes for shader_input in renderpass.get("inputs", [])
+    } & UNUSUAL_INPUTS)
+    if unusual:
+        add(min(15, 5 * len(unusual)), "uses " + ", ".join(unusual))
+
+    return {"score": min(100, score), "reasons": reasons}
+
+def _passes(shader):
+    """ Returns the parts of a shader's render passes that are scored. """
+    if not isinstance(shader, dict):
+        shader = shader.to_json()
+
+    return [
+        {
+            "code": renderpass.get("code", ""),
+            "inputs": [
+                {"id": shader_input.get("id"), "type": shader_input.get("type", shader_input.get("ctype"))}
+                for shader_input in renderpass.get("inputs", [])
+            ],
+            "outputs": [{"id": output.get("id")} for output in renderpass.get("outputs", [])]
+        }
+        for renderpass in shader.get("renderpass", [])
+    ]
+
+def passes_digest(passes):
+    """ Returns the hash identifying render passes in a ScoreCache. """
+    return hashlib.sha256(json.dumps(passes, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+class ScoreCache:
+    """ SQLite backed cache of risk scores keyed by the hash of the scored passes. """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS scores (digest TEXT PRIMARY KEY, result TEXT)")
+        self.db.commit()
+
+    def get(self, digests):
+        """ Returns a dict mapping the cached ones of digests to their results. """
+        results = {}
+        digests = list(digests)
+        with self.lock:
+            # Stay below SQLite's limit on the number of parameters
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                rows = self.db.execute(
+                    "SELECT digest, result FROM scores WHERE digest IN ({})".format(",".join("?" * len(chunk))), chunk
+                )
+                for digest, result in rows:
+                    results[digest] = json.loads(result)
+
+        return results
+
+    def put(self, results):
+        """ Caches a dict mapping digests to results. """
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?)",
+                [(digest, json.dumps(result)) for digest, result in results.items()]
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+def prescreen(shaders, cache=None, workers=None, chunksize=32):
+    """
+    Scores shader dicts or st_xapi.Shaders, e.g. the result of get_shaders(),
+    on up to workers processes, by default one per core. Shaders whose
+    passes are in cache (a ScoreCache) are not scored again.
+    Returns a list of (shader ID, result) tuples in the same order as
+    shaders, where result is a dict as returned by score_passes().
+    """
+
+    entries = []
+    for shader in shaders:
+        if shader is None:
+            continue
+
+        info = shader["info"] if isinstance(shader, dict) else shader.info
+        passes = _passes(shader)
+        entries.append((info["id"], passes_digest(passes), passes))
+
+    results = cache.get({digest for _, digest, _ in entries}) if cache else {}
+
+    # Score each distinct set of passes once
+    missing = {}
+    for _, digest, passes in entries:
+        if digest not in results:
+            missing[digest] = passes
+
+    # Starting processes takes longer than scoring a handful of shaders
+    if len(missing) < chunksize:
+        scored = dict(zip(missing, map(score_passes, missing.values())))
+    else:
+        with ProcessPoolExecutor(workers) as executor:
+            scored = dict(zip(missing, executor.map(score_passes, missing.values(), chunksize=chunksize)))
+
+    if cache and scored:
+        cache.put(scored)
+
+    results.update(scored)
+    return [(shader_id, results[digest]) for shader_id, digest, _ in entries]
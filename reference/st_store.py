@@ -0,0 +1,163 @@
+"""
+A content-addressed store for exported shaders.
+
+Forks and templates share most of their code, so instead of saving each
+shader whole, the code of every render pass and every input descriptor
+is saved once as a zlib compressed blob named after its SHA-256 hash.
+Each shader is saved as a small manifest, which is the shader's JSON
+with pass code and inputs replaced by the hashes of their blobs, and is
+put back together when read.
+
+    root/
+        manifests/<shader id>.json
+        blobs/<first 2 hash digits>/<hash>
+
+>>> from st_store import ShaderStore
+>>> store = ShaderStore("archive")
+>>> for shader in session.iter_all_shaders():
+...     store.put(shader)
+>>> shader = store.get("XslGRr")
+"""
+
+from functools import lru_cache
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+class ShaderStore:
+    def __init__(self, root, blob_cache=1024):
+        """ blob_cache is the number of decompressed blobs kept in memory for reuse. """
+        self.root = root
+        os.makedirs(os.path.join(root, "manifests"), exist_ok=True)
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        self.read_blob = lru_cache(maxsize=blob_cache)(self._read_blob)
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, "blobs", digest[:2], digest)
+
+    def _write(self, path, data):
+        # Write to a temporary file first so readers never see half a file
+        temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with open(temp_path, "wb") as f:
+            f.write(data)
+
+        os.replace(temp_path, path)
+
+    def write_blob(self, data):
+        """ Stores data (bytes) unless it is already stored and returns its hash. """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._write(path, zlib.compress(data, 6))
+
+        return digest
+
+    def _read_blob(self, digest):
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def put(self, shader):
+        """ Stores a shader dict or st_xapi.Shader, replacing any earlier version. Returns its ID. """
+        if not isinstance(shader, dict):
+            shader = shader.to_json()
+
+        manifest = dict(shader)
+        if "renderpass" in shader:
+            manifest["renderpass"] = []
+
+        for renderpass in shader.get("renderpass", []):
+            renderpass = dict(renderpass)
+            if "code" in renderpass:
+                renderpass["code"] = self.write_blob(renderpass["code"].encode("utf-8"))
+
+            if "inputs" in renderpass:
+                renderpass["inputs"] = [
+                    self.write_blob(json.dumps(shader_input, separators=(",", ":")).encode("utf-8"))
+                    for shader_input in renderpass["inputs"]
+                ]
+
+            manifest["renderpass"].append(renderpass)
+
+        shader_id = shader["info"]["id"]
+        self._write(
+            os.path.join(self.root, "manifests", shader_id + ".json"),
+            json.dumps(manifest, separators=(",", ":")).encode("utf-8")
+        )
+
+        return shader_id
+
+    def get(self, shader_id):
+        """ Returns the shader with the given ID encoded in JSON. Raises KeyError if it is not stored. """
+        try:
+            with open(os.path.join(self.root, "manifests", shader_id + ".json"), "rb") as f:
+                shader = json.loads(f.read())
+
+        except FileNotFoundError:
+            raise KeyError(shader_id)
+
+        for renderpass in shader.get("renderpass", []):
+            if "code" in renderpass:
+                renderpass["code"] = self.read_blob(renderpass["code"]).decode("utf-8")
+
+            if "inputs" in renderpass:
+                renderpass["inputs"] = [json.loads(self.read_blob(digest)) for digest in renderpass["inputs"]]
+
+        return shader
+
+    def __contains__(self, shader_id):
+        return os.path.exists(os.path.join(self.root, "manifests", shader_id + ".json"))
+
+    def ids(self):
+        """ Returns the IDs of all stored shaders. """
+        return [name[:-5] for name in os.listdir(os.path.join(self.root, "manifests")) if name.endswith(".json")]
+
+    def delete(self, shader_id):
+        """ Removes a shader's manifest. Its blobs stay until gc() is called. """
+        try:
+            os.remove(os.path.join(self.root, "manifests", shader_id + ".json"))
+        except FileNotFoundError:
+            pass
+
+    def _referenced(self):
+        digests = set()
+        for shader_id in self.ids():
+            with open(os.path.join(self.root, "manifests", shader_id + ".json"), "rb") as f:
+                for renderpass in json.loads(f.read()).get("renderpass", []):
+                    if "code" in renderpass:
+                        digests.add(renderpass["code"])
+
+                    digests.update(renderpass.get("inputs", []))
+
+        return digests
+
+    def gc(self):
+        """ Deletes blobs no longer used by any shader. Returns the number deleted. """
+        referenced = self._referenced()
+        deleted = 0
+        blobs = os.path.join(self.root, "blobs")
+        for prefix in os.listdir(blobs):
+            for digest in os.listdir(os.path.join(blobs, prefix)):
+                if digest not in referenced:
+                    os.remove(os.path.join(blobs, prefix, digest))
+                    deleted += 1
+
+        self.read_blob.cache_clear()
+        return deleted
+
+    def stats(self):
+        """ Returns a dict with the number of shaders and blobs and the bytes they take up on disk. """
+        stats = {"shaders": 0, "blobs": 0, "manifest_bytes": 0, "blob_bytes": 0}
+        for entry in os.scandir(os.path.join(self.root, "manifests")):
+            stats["shaders"] += 1
+            stats["manifest_bytes"] += entry.stat().st_size
+
+        blobs = os.path.join(self.root, "blobs")
+        for prefix in os.listdir(blobs):
+            for entry in os.scandir(os.path.join(blobs, prefix)):
+                stats["blobs"] += 1
+                stats["blob_bytes"] += entry.stat().st_size
+
+        return stats
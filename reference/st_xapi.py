@@ -15,10 +15,12 @@ Current capabilities:
 - get/create/update/delete playlist
 - get shader relation to playlists
 - add/remove shader from playlist
+- get shaders in playlist
 - get/post/hide/unhide comments
 - get notifications
 - get following/followers
 - follow/unfollow users
+- get apps
 - create app
 - delete app
 
@@ -29,14 +31,53 @@ Current capabilities:
 >>> shader = session.get_shaders(shader_ids[:1])[0]
 >>> fork_id = session.upload_shader(shader, is_fork=True)
 >>> session.signout()
+
+AsyncShadertoySession offers the same methods as coroutines so that many
+requests can be in flight at once:
+
+>>> async with AsyncShadertoySession(max_concurrency=16) as session:
+...     comments = await asyncio.gather(*map(session.get_comments, shader_ids))
+
+Short-lived scripts can skip importing requests with the http.client based
+HTTPTransport:
+
+>>> session = ShadertoySession(transport=HTTPTransport())
+
+Run as a script for resumable exports, mirrors and playlist edits, see main():
+
+    python -m st_xapi export shaders.ndjson --workers 8
 """
 
-import requests
-from urllib.parse import urlparse, parse_qsl
+from urllib.parse import urlparse, urlsplit, urljoin, parse_qsl, urlencode
 import base64
+import gzip
+import hashlib
 import json
+import zlib
+import codecs
+from collections import OrderedDict
+import os
+import random
+import sys
+import re
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from enum import Enum
 
+# requests, sqlite3, asyncio, concurrent.futures, inspect and st_pages (which
+# imports html.parser) are imported where they are first needed, so that
+# importing this module and using helpers which make no requests, e.g.
+# get_embeddable_url(), stays fast for short-lived scripts
+
+# Decode responses with orjson if it is installed, it is several times faster
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 # Test shaders
 # - https://www.shadertoy.com/view/Dd3GR8
 # - https://www.shadertoy.com/view/433SDr
@@ -44,8 +85,6 @@ from enum import Enum
 # - https://www.shadertoy.com/view/MXcSWr
 
 # TODO
-# - get shaders in playlist (scrape gShaderIDs array)
-# - get apps (scrape table)
 # - get/set account preferences?
 # - create/change pw/delete account???
 
@@ -112,18 +151,1081 @@ class ShadertoyError(Exception):
 
         super().__init__(message)
 
-class ShadertoySession:
-    def __init__(self):
-        self.session = requests.Session()
-        self.signed_in = False
+def iter_json_array(chunks):
+    """
+    Decodes a JSON array from an iterable of bytes chunks, e.g. a streamed
+    response, yielding each element as soon as it has been received.
+    Only the element being received is buffered, along with at most as much
+    of what follows it.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    started = False
+    done = False
+
+    # Length of the partial element when it last failed to decode
+    failed = 0
+    while True:
+        # Skip whitespace and separators between elements
+        while pos < len(buffer):
+            if buffer[pos] in " \t\r\n" or (started and buffer[pos] == ","):
+                pos += 1
+
+            elif buffer[pos] == "[" and not started:
+                started = True
+                pos += 1
+
+            else:
+                break
+
+        if pos < len(buffer):
+            if not started:
+                raise ValueError("expected a JSON array")
+
+            if buffer[pos] == "]":
+                return
+
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+
+                # A number might continue in the next chunk, e.g. "1." of "1.5"
+                if done or (end < len(buffer) and buffer[end] in " \t\r\n,]"):
+                    yield value
+                    pos = end
+                    failed = 0
+                    continue
+
+            except ValueError:
+                if done:
+                    raise
+
+            failed = len(buffer) - pos
+
+        if done:
+            raise ValueError("unterminated JSON array")
+
+        # Decoding a large element again with every chunk would take quadratic
+        # time, so wait until the partial element has doubled in size
+        pieces = [buffer[pos:]]
+        size = len(pieces[0])
+        pos = 0
+        while size == 0 or size < 2 * failed:
+            chunk = next(chunks, None)
+            if chunk is None:
+                done = True
+                pieces.append(utf8.decode(b"", True))
+                break
+
+            pieces.append(utf8.decode(chunk))
+            size += len(pieces[-1])
+
+        buffer = "".join(pieces)
+
+def _parse_page(response, variables=()):
+    """ Feeds a streamed response to an st_pages.PageParser chunk by chunk and returns the parser. """
+    from st_pages import PageParser
+
+    parser = PageParser(variables)
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for chunk in response.iter_content(65536):
+            parser.feed(utf8.decode(chunk))
+
+        parser.feed(utf8.decode(b"", True))
+        parser.close()
+    finally:
+        response.close()
+
+    return parser
+
+# Shared tuples of top level shader keys, so each Shader only holds a reference
+_KEY_ORDERS = {}
+
+def _compress_json(value):
+    return zlib.compress(json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8"), 1)
+
+class Input:
+    """ An input of a render pass, such as a texture or another buffer. """
+    __slots__ = ("id", "ctype", "channel", "filepath", "sampler", "published", "json")
+
+    def __init__(self, input_json):
+        self.id = input_json.get("id")
+        self.ctype = input_json.get("ctype")
+        self.channel = input_json.get("channel")
+        self.filepath = input_json.get("filepath")
+        self.sampler = input_json.get("sampler")
+        self.published = input_json.get("published")
+        self.json = input_json
+
+class RenderPass:
+    """
+    A render pass of a Shader. Holds the pass as zlib compressed JSON and
+    only decodes it the first time one of its fields is accessed.
+    """
+
+    __slots__ = ("raw", "_json")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self._json = None
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.loads(zlib.decompress(self.raw))
+
+        return self._json
+
+    @property
+    def name(self):
+        return self.to_json().get("name")
+
+    @property
+    def type(self):
+        return self.to_json().get("type")
+
+    @property
+    def code(self):
+        return self.to_json().get("code")
+
+    @property
+    def description(self):
+        return self.to_json().get("description")
+
+    @property
+    def inputs(self):
+        return [Input(input_json) for input_json in self.to_json().get("inputs", [])]
+
+    @property
+    def outputs(self):
+        return self.to_json().get("outputs", [])
+
+class Shader:
+    """
+    Compact representation of a shader as returned by get_shaders().
+    The info metadata is decoded up front, render passes are kept as
+    zlib compressed JSON and decoded when accessed through passes.
+    to_json() returns exactly the JSON the shader was made from, which
+    can be passed to upload_shader().
+    """
+
+    __slots__ = ("id", "name", "username", "description", "date", "tags", "likes", "privacy", "info", "_other",
+                 "_keys", "_passes")
+
+    def __init__(self, shader_json):
+        info = shader_json["info"]
+        self.id = info.get("id")
+        self.name = info.get("name")
+        self.username = info.get("username")
+        self.description = info.get("description")
+        self.date = int(info.get("date", 0))
+        self.tags = info.get("tags", [])
+        self.likes = info.get("likes", 0)
+        self.privacy = ShaderPrivacy(info["published"]) if "published" in info else None
+        self.info = info
+
+        # Anything else at the top level, e.g. "ver"
+        self._other = {k: v for k, v in shader_json.items() if k not in ("info", "renderpass")}
+        keys = tuple(shader_json)
+        self._keys = _KEY_ORDERS.setdefault(keys, keys)
+        self._passes = tuple(_compress_json(p) for p in shader_json.get("renderpass", []))
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """ Returns the Shader of a JSON encoded shader, e.g. a line of export_ndjson(). """
+        return cls(json.loads(raw))
+
+    @property
+    def passes(self):
+        return [RenderPass(raw) for raw in self._passes]
+
+    def to_json(self):
+        shader_json = {}
+        for key in self._keys:
+            if key == "info":
+                shader_json[key] = dict(self.info)
+            elif key == "renderpass":
+                shader_json[key] = [json.loads(zlib.decompress(raw)) for raw in self._passes]
+            else:
+                shader_json[key] = self._other[key]
+
+        return shader_json
+
+class ShaderCache:
+    """
+    On-disk cache of shaders returned by ShadertoySession.get_shaders(),
+    stored in an SQLite database at path.
+
+    At most max_entries shaders are kept, the least recently used ones are
+    evicted first. A cached shader is stale if it was fetched more than
+    max_age seconds ago (when max_age is set) or if its info.date is older
+    than the revision the caller knows about.
+    """
+
+    def __init__(self, path, max_entries=10000, max_age=None):
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+        import sqlite3
+
+        # Shared by all threads of a session and its clones
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS shaders ("
+            "id TEXT PRIMARY KEY, options TEXT, date INTEGER, fetched REAL, used REAL, data TEXT)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS shaders_used ON shaders (used)")
+        self.db.commit()
+
+    def get(self, shader_ids, options, revisions=None):
+        """
+        Looks up shader_ids fetched with the same options.
+        revisions optionally maps shader IDs to their latest known info.date.
+        Returns a tuple (found, missing) where found maps shader IDs to cached
+        shaders and missing lists the IDs which are not cached or stale.
+        """
+
+        found = {}
+        missing = []
+        now = time.time()
+        with self.lock:
+            for shader_id in shader_ids:
+                row = self.db.execute(
+                    "SELECT options, date, fetched, data FROM shaders WHERE id = ?", (shader_id,)
+                ).fetchone()
+
+                if row is None or row[0] != options:
+                    self.misses += 1
+                    missing.append(shader_id)
+
+                elif (self.max_age is not None and now - row[2] > self.max_age) or \
+                        (revisions and int(revisions.get(shader_id, 0)) > row[1]):
+                    self.stale += 1
+                    missing.append(shader_id)
+
+                else:
+                    self.hits += 1
+                    found[shader_id] = json.loads(row[3])
+
+            self.db.executemany("UPDATE shaders SET used = ? WHERE id = ?", [(now, i) for i in found])
+            self.db.commit()
+
+        return found, missing
+
+    def put(self, shaders, options):
+        """ Stores shaders fetched with the given options, evicting old entries if full. """
+        now = time.time()
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO shaders VALUES (?, ?, ?, ?, ?, ?)", [
+                    (shader["info"]["id"], options, int(shader["info"].get("date", 0)), now, now, json.dumps(shader))
+                    for shader in shaders
+                ]
+            )
+
+            excess = self.db.execute("SELECT COUNT(*) FROM shaders").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.db.execute(
+                    "DELETE FROM shaders WHERE id IN (SELECT id FROM shaders ORDER BY used LIMIT ?)", (excess,)
+                )
+                self.evictions += excess
+
+            self.db.commit()
+
+    def invalidate(self, shader_ids):
+        """ Removes the given shaders from the cache. """
+        with self.lock:
+            self.db.executemany("DELETE FROM shaders WHERE id = ?", [(i,) for i in shader_ids])
+            self.db.commit()
+
+    def clear(self):
+        """ Removes every shader from the cache and resets the counters. """
+        with self.lock:
+            self.db.execute("DELETE FROM shaders")
+            self.db.commit()
+            self.hits = self.misses = self.stale = self.evictions = 0
+
+    def stats(self):
+        """ Returns a dict with the cache size and hit/miss counters. """
+        with self.lock:
+            size = self.db.execute("SELECT COUNT(*) FROM shaders").fetchone()[0]
+
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions
+        }
+
+    def close(self):
+        self.db.close()
+
+class CommentCache:
+    """
+    On-disk cache of comment threads for get_comments_bulk(), stored in an
+    SQLite database at path together with the hash of each thread.
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS comments (id TEXT PRIMARY KEY, hash TEXT, fetched REAL, data TEXT)")
+        self.db.commit()
+
+    def hashes(self, shader_ids):
+        """ Returns a dict mapping the cached shader IDs among shader_ids to the hashes of their threads. """
+        with self.lock:
+            return {
+                shader_id: row[0] for shader_id in shader_ids
+                for row in self.db.execute("SELECT hash FROM comments WHERE id = ?", (shader_id,))
+            }
+
+    def get(self, shader_id):
+        """ Returns the cached comments of a shader, or None. """
+        with self.lock:
+            row = self.db.execute("SELECT data FROM comments WHERE id = ?", (shader_id,)).fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    def put(self, shader_id, digest, comments):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO comments VALUES (?, ?, ?, ?)",
+                (shader_id, digest, time.time(), json.dumps(comments))
+            )
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+# Seconds for which responses to each read operation are memoized by default
+MEMO_TTLS = {
+    "/shadertoy s": 60,
+    "/shadertoy psg": 30,
+    "/shadertoy pg": 30,
+    "/shadertoy fcg": 30,
+    "/shadertoy gsibuifpt": 30
+}
+
+# Read operations whose memoized responses each write operation makes stale
+MEMO_INVALIDATES = {
+    "/shadertoy a": ("/shadertoy gsibuifpt",),
+    "/shadertoy u": ("/shadertoy s", "/shadertoy gsibuifpt"),
+    "/shadertoy f": ("/shadertoy gsibuifpt",),
+    "/shadertoy d": ("/shadertoy s", "/shadertoy gsibuifpt", "/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy l": ("/shadertoy s",),
+    "/shadertoy pas": ("/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy prs": ("/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy pa": ("/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy pu": ("/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy pd": ("/shadertoy psg", "/shadertoy pg"),
+    "/shadertoy fs": ("/shadertoy fcg",),
+    "/shadertoy fu": ("/shadertoy fcg",),
+    "/comment comment": ("/comment s",),
+    "/comment hide": ("/comment s",),
+    "/signin user": tuple(MEMO_TTLS),
+    "/signout ": tuple(MEMO_TTLS)
+}
+
+def _shader_ids(data):
+    """ Returns the IDs of the shaders a request is about, for memo invalidation. """
+    form = dict(data or [])
+    if "sid" in form:
+        return {form["sid"]}
+
+    if "s" in form:
+        return set(json.loads(form["s"])["shaders"]) if form["s"].startswith("{") else {form["s"]}
+
+    return set()
+
+class ResponseMemo:
+    """
+    Memoizes responses to read operations for a ShadertoySession and its
+    clones, in memory. Identical reads made at the same time share a single
+    request, and their response is reused for the operation's TTL (see
+    MEMO_TTLS). At most max_entries responses are kept, the least recently
+    used are evicted first. Write operations made through the session
+    invalidate the memoized responses they affect (see MEMO_INVALIDATES).
+    """
+
+    def __init__(self, ttls=None, max_entries=1024):
+        self.ttls = MEMO_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+        # Maps request keys to (expiry time, op, shader IDs, response)
+        self.entries = OrderedDict()
+
+        # Maps request keys to [done event, response, exception] of requests in flight
+        self.inflight = {}
+
+        # Incremented by every invalidation, so responses fetched before one are not stored
+        self.generation = 0
+
+    def fetch(self, op, path, data, send):
+        """ Returns the response to a request, calling send() to make it if needed. """
+        ttl = self.ttls.get(op)
+        if ttl is None:
+            return send()
+
+        key = json.dumps([path, data], default=str)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = [threading.Event(), None, None]
+                generation = self.generation
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight[0].wait()
+            if flight[2]:
+                raise flight[2]
+
+            return flight[1]
+
+        try:
+            flight[1] = send()
+            return flight[1]
+
+        except Exception as e:
+            flight[2] = e
+            raise
+
+        finally:
+            with self.lock:
+                del self.inflight[key]
+                response = flight[1]
+                if response is not None and response.ok and ttl > 0 and generation == self.generation:
+                    self.entries[key] = (time.monotonic() + ttl, op, _shader_ids(data), response)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+
+            flight[0].set()
+
+    def invalidate(self, op, data=None):
+        """
+        Drops the memoized responses made stale by the write operation op.
+        Responses about specific shaders are only dropped if op concerns one
+        of them, or no shader in particular.
+        """
+
+        ops = MEMO_INVALIDATES.get(op)
+        if not ops:
+            return
 
-        # Set default headers to be included in every request
-        # This is ESSENTIAL. Also, every request must specify a Referer URL.
-        self.session.headers.update({
-            "User-Agent": "shadertoy-client",
-            "Origin": "https://www.shadertoy.com"
+        shader_ids = _shader_ids(data)
+        with self.lock:
+            self.generation += 1
+            for key, (_, entry_op, entry_ids, _) in list(self.entries.items()):
+                if entry_op in ops and (not shader_ids or not entry_ids or shader_ids & entry_ids):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+class TokenBucket:
+    """
+    Token bucket rate limiter letting through rate requests per second on
+    average, with bursts of up to capacity requests.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Takes a token, blocking until one is available. """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Going into debt reserves the next token for this caller
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+class RequestStats:
+    """
+    Per operation request statistics of a ShadertoySession and its clones.
+    Operations are named after the endpoint and the form op code, e.g.
+    "/shadertoy s" for get_shaders(), "/shadertoy psg" for
+    get_shader_playlist_stats() or "/comment s" for get_comments().
+
+    If set, callback is called with a dict describing every request:
+    op, latency (seconds), sent and received (bytes) and error, which is
+    an ErrorCode name, "HTTP <status>", an exception name or None.
+    """
+
+    # Upper bounds of the latency histogram buckets in seconds, the last bucket is unbounded
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.lock = threading.Lock()
+        self.ops = {}
+
+    def record(self, op, latency=None, sent=0, received=0, error=None):
+        """ Records a request, or only an error if latency is None. """
+        with self.lock:
+            entry = self.ops.get(op)
+            if entry is None:
+                entry = self.ops[op] = {
+                    "count": 0,
+                    "errors": {},
+                    "latency_total": 0.0,
+                    "latency_max": 0.0,
+                    "latency_histogram": [0] * (len(self.BUCKETS) + 1),
+                    "sent": 0,
+                    "received": 0
+                }
+
+            if latency is not None:
+                bucket = 0
+                while bucket < len(self.BUCKETS) and latency > self.BUCKETS[bucket]:
+                    bucket += 1
+
+                entry["count"] += 1
+                entry["latency_total"] += latency
+                entry["latency_max"] = max(entry["latency_max"], latency)
+                entry["latency_histogram"][bucket] += 1
+                entry["sent"] += sent
+                entry["received"] += received
+
+            if error:
+                entry["errors"][error] = entry["errors"].get(error, 0) + 1
+
+        if self.callback:
+            self.callback({
+                "op": op,
+                "latency": latency,
+                "sent": sent,
+                "received": received,
+                "error": error
+            })
+
+    def snapshot(self):
+        """ Returns a copy of the statistics as a dict mapping operations to their stats. """
+        with self.lock:
+            return json.loads(json.dumps(self.ops))
+
+    def reset(self):
+        """ Clears all statistics. """
+        with self.lock:
+            self.ops = {}
+
+def icon_data_url(shader_icon):
+    """
+    Returns the data URL of shader_icon, an open image file or a path,
+    for upload_shader(). The file is base64 encoded in chunks and closed.
+    """
+
+    if isinstance(shader_icon, str):
+        shader_icon = open(shader_icon, "rb")
+
+    with shader_icon:
+        ext = shader_icon.name[shader_icon.name.rfind(".")+1:]
+        parts = ["data:image/" + ext + ";base64,"]
+
+        # Chunks are a multiple of 3 bytes long, so they encode without padding
+        chunk = shader_icon.read(3 * 65536)
+        while chunk:
+            parts.append(base64.b64encode(chunk).decode("ascii"))
+            chunk = shader_icon.read(3 * 65536)
+
+    return "".join(parts)
+
+# Form fields which are never written to cassettes
+SECRET_FIELDS = {"password"}
+
+def _cassette_key(url, data):
+    return json.dumps([url, [(k, "*" if k in SECRET_FIELDS else str(v)) for k, v in data or []]])
+
+class CassetteResponse:
+    """ Replayed response, providing the parts of requests.Response used by ShadertoySession. """
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.headers = {"Content-Length": str(len(content))}
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        for i in range(0, len(self.content), chunk_size):
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+class RecordingTransport:
+    """
+    Transport passing requests on to inner (e.g. a requests.Session) and
+    appending every request and response to the gzipped cassette at path,
+    for later use with ReplayTransport. Password fields are not recorded.
+
+    >>> session.transport = RecordingTransport(session.session, "crawl.cassette")
+    """
+
+    def __init__(self, inner, path):
+        self.inner = inner
+        self.path = path
+        self.lock = threading.Lock()
+
+    @property
+    def cookies(self):
+        return getattr(self.inner, "cookies", None)
+
+    def clone(self, session, clone):
+        """
+        Returns the transport for clone, a clone() of session, recording to
+        the same cassette. If inner is the requests.Session of session, which
+        is not thread safe, the clone's own is wrapped instead.
+        """
+
+        if hasattr(self.inner, "clone"):
+            inner = self.inner.clone(session, clone)
+        else:
+            inner = clone.session if self.inner is session._session else self.inner
+
+        transport = RecordingTransport(inner, self.path)
+        transport.lock = self.lock
+        return transport
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return self._record(_cassette_key(url, data), self.inner.post(url, data=data, headers=headers, **kwargs))
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        return self._record(_cassette_key("GET " + url, params), self.inner.get(url, params=params, headers=headers, **kwargs))
+
+    def _record(self, key, response):
+        record = json.dumps({
+            "key": key,
+            "url": response.url,
+            "status": response.status_code,
+            "body": base64.b64encode(response.content).decode("ascii")
         })
 
+        # Each append adds a gzip member, which gzip reads back as one stream
+        with self.lock, gzip.open(self.path, "at", encoding="utf-8") as f:
+            f.write(record + "\n")
+
+        return response
+
+class ReplayTransport:
+    """
+    Transport answering requests from a cassette written by RecordingTransport,
+    without any network access. Requests are matched on method, URL and form
+    fields or query parameters.
+    Identical requests get the recorded responses in order, the last one is
+    repeated once they run out. Unmatched requests raise LookupError.
+
+    >>> session = ShadertoySession(transport=ReplayTransport("crawl.cassette"))
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.responses = {}
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                self.responses.setdefault(record["key"], []).append(
+                    CassetteResponse(record["url"], record["status"], base64.b64decode(record["body"]))
+                )
+
+        self.positions = dict.fromkeys(self.responses, 0)
+
+    def post(self, url, data=None, headers=None, **kwargs):
+        return self._replay(_cassette_key(url, data))
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        return self._replay(_cassette_key("GET " + url, params))
+
+    def _replay(self, key):
+        with self.lock:
+            if key not in self.responses:
+                raise LookupError("no recorded response for " + key)
+
+            responses = self.responses[key]
+            position = self.positions[key]
+            self.positions[key] = min(position + 1, len(responses) - 1)
+            return responses[position]
+
+class HTTPResponse:
+    """ Response of an HTTPTransport, providing the parts of requests.Response used by ShadertoySession. """
+
+    def __init__(self, url, response, stream):
+        self.url = url
+        self.status_code = response.status
+        self.ok = response.status < 400
+        self.headers = response.msg
+        self.raw = response
+        self.complete = False
+        self._content = None
+        if not stream:
+            self.content
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self.raw.read()
+            self.complete = True
+
+        return self._content
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        if self._content is not None:
+            for i in range(0, len(self._content), chunk_size):
+                yield self._content[i:i + chunk_size]
+
+            return
+
+        chunk = self.raw.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.raw.read(chunk_size)
+
+        self.complete = True
+
+    def close(self):
+        self.raw.close()
+
+class ConnectFailedError(ConnectionError):
+    """ Raised by HTTPTransport when it could not connect, so the request was not sent. """
+
+class HTTPTransport:
+    """
+    Transport built on http.client alone, for scripts which are done before
+    importing requests would pay off. Each thread keeps one connection per
+    host alive, redirects are followed and cookies are kept in cookies, an
+    http.cookiejar.CookieJar. It is thread safe, so a session and its clones
+    can share it. Call close() once done with it.
+
+    >>> session = ShadertoySession(transport=HTTPTransport())
+    """
+
+    def __init__(self, timeout=30, max_redirects=10):
+        from http.cookiejar import CookieJar
+
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.cookies = CookieJar()
+        self.headers = {"User-Agent": "shadertoy-client"}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.connections = []
+
+    def post(self, url, data=None, headers=None, stream=False, **kwargs):
+        return self.request("POST", url, urlencode(data or []).encode("utf-8"), headers, stream)
+
+    def get(self, url, params=None, headers=None, stream=False, **kwargs):
+        if params:
+            url += ("&" if "?" in url else "?") + urlencode(params)
+
+        return self.request("GET", url, None, headers, stream)
+
+    def _connection(self, scheme, host):
+        import http.client
+
+        connections = self.local.__dict__.setdefault("connections", {})
+        if (scheme, host) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            connections[scheme, host] = connection_class(host, timeout=self.timeout)
+            with self.lock:
+                self.connections.append(connections[scheme, host])
+
+        return connections[scheme, host]
+
+    def _send(self, parts, method, body, headers):
+        import http.client
+
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        connection = self._connection(parts.scheme, parts.netloc)
+
+        # A response which was not read to the end leaves its connection unusable
+        pending = getattr(self.local, "pending", None)
+        if pending is not None and not pending[1].complete:
+            pending[0].close()
+            self.local.pending = None
+
+        if connection.sock is None:
+            try:
+                connection.connect()
+            except OSError as e:
+                connection.close()
+                raise ConnectFailedError(str(e)) from e
+
+        for attempt in range(2):
+            reused = connection.sock is not None
+            try:
+                connection.request(method, target, body, headers)
+                return connection, connection.getresponse()
+
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+
+                # The server may have closed a kept-alive connection, which is worth one retry
+                if attempt or not reused:
+                    raise e if isinstance(e, OSError) else ConnectionError(str(e))
+
+    def request(self, method, url, body=None, headers=None, stream=False):
+        """ Sends a request, following redirects, and returns an HTTPResponse. """
+        import urllib.request
+
+        for _ in range(self.max_redirects + 1):
+            parts = urlsplit(url)
+            request = urllib.request.Request(url, method=method)
+            self.cookies.add_cookie_header(request)
+            all_headers = dict(self.headers, Origin=parts.scheme + "://" + parts.netloc, **(headers or {}))
+            all_headers.update(request.unredirected_hdrs)
+            if body is not None:
+                all_headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+            connection, raw = self._send(parts, method, body, all_headers)
+            self.cookies.extract_cookies(raw, request)
+            location = raw.getheader("Location")
+            if raw.status not in (301, 302, 303, 307, 308) or not location:
+                response = HTTPResponse(url, raw, stream)
+                self.local.pending = connection, response
+                return response
+
+            raw.read()
+            url = urljoin(url, location)
+
+            # Like browsers and requests, POSTs redirected with these become GETs
+            if raw.status in (301, 302, 303):
+                method = "GET"
+                body = None
+
+        raise ConnectionError("too many redirects")
+
+    def close(self):
+        """ Closes the connections of all threads. """
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+
+            self.connections = []
+
+# HTTP statuses which are worth retrying
+TRANSIENT_STATUSES = {429, 500, 502, 503, 504}
+
+# Operations which create something each time they are sent. A timeout or a
+# gateway error may come after the server saved it, so these are only retried
+# when the connection failed before the request was sent
+CREATING_OPS = {"/shadertoy a", "/shadertoy f", "/shadertoy pa", "/comment comment", "/myapps a"}
+
+def _not_sent(error):
+    """ Returns whether a transport error happened while connecting, before the request was sent. """
+    if isinstance(error, ConnectFailedError):
+        return True
+
+    # requests wraps the urllib3 error, ConnectTimeoutError or a subclass when connecting failed
+    reason = getattr(error.args[0] if error.args else None, "reason", None)
+    return any(cls.__name__ == "ConnectTimeoutError" for cls in type(reason).__mro__)
+
+def _retry_after(response):
+    """ Returns the seconds to wait before retrying given by a 429 response's Retry-After header, or None. """
+    value = response.headers.get("Retry-After") if response.status_code == 429 else None
+    if not value:
+        return None
+
+    if value.strip().isdigit():
+        return int(value)
+
+    from email.utils import parsedate_to_datetime
+
+    try:
+        return max(0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def _read_archive_index(path):
+    """ Returns the index of the archive directory at path, see sync_archive(). """
+    index_path = os.path.join(path, "index.json")
+    if not os.path.exists(index_path):
+        return {}
+
+    with open(index_path, encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_archive_index(path, index):
+    """ Replaces the index of the archive directory at path with index. """
+    index_path = os.path.join(path, "index.json")
+    with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(index, f)
+
+    os.replace(index_path + ".tmp", index_path)
+
+def _write_archive_shader(path, shader):
+    """ Writes shader to the archive directory at path, replacing its file only once it is complete. """
+    shader_path = os.path.join(path, "shaders", shader["info"]["id"] + ".json")
+    with open(shader_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(shader, f)
+
+    os.replace(shader_path + ".tmp", shader_path)
+
+def _stale_ids(index, remote_ids, revisions=None, refresh=False):
+    """
+    Returns the IDs in remote_ids of the shaders which are not in the archive
+    index or are tombstoned, or which changed according to revisions, see
+    sync_archive(). All of them if refresh is True.
+    """
+
+    revisions = revisions or {}
+    stale = []
+    for shader_id in remote_ids:
+        entry = index.get(shader_id)
+        if refresh or entry is None or entry.get("deleted") or \
+                int(revisions.get(shader_id, 0)) > entry["date"]:
+            stale.append(shader_id)
+
+    return stale
+
+def _tombstone(index, remote_ids, when):
+    """ Marks the shaders of the archive index not in remote_ids as deleted at when. Returns how many were. """
+    remote_ids = set(remote_ids)
+    deleted = 0
+    for shader_id, entry in index.items():
+        if shader_id not in remote_ids and not entry.get("deleted"):
+            entry["deleted"] = int(when)
+            deleted += 1
+
+    return deleted
+
+class ShadertoySession:
+    def __init__(self, pool_size=10, cache=None, rate_limits=None, max_retries=3, backoff=0.5, quota_wait=0, stats=None,
+                 base_url="https://www.shadertoy.com", transport=None, memo=None):
+        """
+        pool_size: number of connections kept alive for reuse.
+        cache: optional ShaderCache used by get_shaders().
+        rate_limits: dict mapping endpoints ("/shadertoy", "/comment", "/myapps")
+            to the TokenBucket limiting requests to them.
+        max_retries, backoff: transient failures are retried up to max_retries
+            times after a random delay of up to backoff * 2^attempt seconds,
+            or as long as a 429 response's Retry-After header asks. Requests
+            creating something (see CREATING_OPS) are only retried if they
+            could not be sent.
+        quota_wait: if the daily quota is reached, uploads and comments are
+            parked until it resets, as long as that is less than quota_wait
+            seconds away. Otherwise ErrorCode.DAILY_QUOTA_REACHED is raised.
+        stats: RequestStats collecting per operation statistics, by default
+            a new one.
+        base_url: site to talk to, e.g. a local stand-in server for testing.
+        transport: object with requests.Session compatible post() and get()
+            methods that requests are sent through, by default the requests.Session
+            of this session. A transport passed in is shared with clones,
+            unless it has a clone(session, clone) method returning the one for
+            a clone. HTTPTransport avoids importing requests at all.
+        memo: optional ResponseMemo coalescing and memoizing read requests.
+        """
+
+        self.pool_size = pool_size
+        self.signed_in = False
+        self.cache = cache
+        self.rate_limits = rate_limits or {}
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.quota_wait = quota_wait
+        self.stats = stats or RequestStats()
+        self.base_url = base_url
+        self.memo = memo
+
+        # The requests.Session and the transport are created on first use, see session
+        self._session = None
+        self._transport = transport
+
+        # Operation of the last request, which errors are attributed to
+        self.last_op = None
+
+        # Kept in memory to sign in again when the session expires
+        self.credentials = None
+
+        # File the signin state is saved to, see load_state()
+        self.state_path = None
+
+        # Maps operations (see last_op) to the time at which they can be used again
+        self.parked = {}
+
+    @property
+    def session(self):
+        """ The requests.Session of this session, created when first used. """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+
+            # Keep up to pool_size connections alive for reuse
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self._session.mount(self.base_url, adapter)
+
+            # Set default headers to be included in every request
+            # This is ESSENTIAL. Also, every request must specify a Referer URL.
+            self._session.headers.update({
+                "User-Agent": "shadertoy-client",
+                "Origin": self.base_url
+            })
+
+        return self._session
+
+    @property
+    def transport(self):
+        return self._transport or self.session
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def cookies(self):
+        """ The cookie jar of the transport, or of the requests.Session if the transport has none. """
+        cookies = getattr(self.transport, "cookies", None)
+        return self.session.cookies if cookies is None else cookies
+
     def require_signin(self):
         """ Raises error with code ErrorCode.SIGNIN_REQUIRED if not signed in. """
         if not self.signed_in:
@@ -134,45 +1236,261 @@ class ShadertoySession:
         if self.signed_in:
             self.signout()
 
-        response = self.session.post(
-            "https://www.shadertoy.com/signin", data=[
+        response = self._post(
+            "/signin", "/signin", [
                 ("user", username),
                 ("password", password)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/signin"
-            }
+            ]
         )
 
         # Check if we got sent back to signin with an error
         url = urlparse(response.url)
         query = parse_qsl(url.query)
         if url.path == "/signin" and ("error", "1") in query:
-            raise ShadertoyError(ErrorCode.INVALID_SIGNIN)
+            raise self._error(ErrorCode.INVALID_SIGNIN)
 
         self.signed_in = True
+        self.credentials = (username, password)
+        if self.state_path:
+            self.save_state(self.state_path)
 
     def signout(self):
         """ Signs out of shadertoy. """
         if self.signed_in:
-            self.session.post(
-                "https://www.shadertoy.com/signout", headers={
-                    "Referer": "https://www.shadertoy.com/"
-                }
-            )
+            self._post("/signout", "/")
 
             self.signed_in = False
+            self.credentials = None
+            if self.state_path:
+                self.save_state(self.state_path)
+
+    def save_state(self, path):
+        """
+        Saves the cookies and signin state to the file at path, readable only
+        by the current user. The password is never saved.
+        """
+
+        cookies = []
+        for cookie in self.cookies:
+            cookie = dict(vars(cookie))
+            cookie["rest"] = cookie.pop("_rest")
+            cookies.append(cookie)
+
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            json.dump({"signed_in": self.signed_in, "cookies": cookies}, f)
+
+    def load_state(self, path, username=None, password=None):
+        """
+        Restores the cookies and signin state saved by save_state(), so that
+        signin() can be skipped. The session is not checked until it is used.
+        If username and password are given, a request failing with
+        ErrorCode.SESSION_EXPIRED signs in again and is retried.
+        From now on the state is saved to path whenever it changes.
+        Returns a bool determining whether any state was restored.
+        """
+
+        self.state_path = path
+        if username and password:
+            self.credentials = (username, password)
+
+        if not os.path.exists(path):
+            return False
+
+        from http.cookiejar import Cookie
+
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+
+        for cookie in state["cookies"]:
+            self.cookies.set_cookie(Cookie(**cookie))
+
+        self.signed_in = state["signed_in"]
+        return True
+
+    def _reauthenticate(self):
+        """ Signs in again with the last credentials. Returns False if there are none. """
+        if not self.credentials:
+            return False
+
+        self.signed_in = False
+        self.signin(*self.credentials)
+        return True
 
     def clear_cookies(self):
         """ Clears all cookies stored in the session. """
-        self.session.cookies.clear()
+        self.cookies.clear()
 
     def close(self):
-        """ Closes the session. Call this when you are done using the session. """
-        self.session.close()
+        """
+        Closes the session. Call this when you are done using the session.
+        A transport passed in may be shared with clones and is not closed.
+        """
+
+        if self._session is not None:
+            self._session.close()
+
+    def clone(self):
+        """
+        Returns a new session sharing this session's cookies and signin state.
+        requests.Session is not thread safe, so give each thread its own clone.
+        """
+
+        session = ShadertoySession(
+            1, self.cache, self.rate_limits, self.max_retries, self.backoff,
+            self.quota_wait, self.stats, self.base_url, None, self.memo
+        )
+
+        # Transports with their own cookie jar share it with clones already
+        cookies = getattr(self._transport, "cookies", None)
+        if cookies is None or (self._session is not None and cookies is self._session.cookies):
+            session.session.cookies = self.session.cookies
+
+        session.transport = self._transport
+        if hasattr(self._transport, "clone"):
+            session.transport = self._transport.clone(self, session)
+
+        session.signed_in = self.signed_in
+        session.parked = self.parked
+        session.credentials = self.credentials
+        return session
+
+    def _parallel(self, function, items, workers, callback=None):
+        """
+        Calls function(session, item) for every item on up to workers threads,
+        each of which uses its own clone() of this session.
+        callback(item, result, exception) is called as each item is done, one
+        call at a time.
+        Returns a list of (result, exception) tuples in the same order as items.
+        """
+
+        if not items:
+            return []
+
+        # Sessions are handed out to one item at a time
+        idle = queue.Queue()
+        for _ in range(min(workers, len(items))):
+            idle.put(self.clone())
+
+        lock = threading.Lock()
+
+        def call(item):
+            member = idle.get()
+            try:
+                result = function(member, item), None
+            except Exception as e:
+                result = None, e
+            finally:
+                idle.put(member)
+
+            if callback:
+                with lock:
+                    callback(item, *result)
+
+            return result
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(idle.qsize()) as executor:
+            results = list(executor.map(call, items))
+
+        while not idle.empty():
+            idle.get().close()
+
+        return results
+
+    def _post(self, path, referer, data=None, op=None, stream=False):
+        """
+        Posts data to the endpoint path, with referer as the Referer path.
+        Waits for the endpoint's rate limit and any quota parking first,
+        and retries transient failures with jittered exponential backoff.
+        op is the form op code the request is recorded under in stats,
+        the name of the first form field by default.
+        If stream is True the response body is not read up front.
+        """
+
+        self.last_op = path + " " + (op or (data[0][0] if data else ""))
+        if self.memo is None or stream:
+            return self._send(path, referer, data, stream)
+
+        response = self.memo.fetch(self.last_op, path, data, lambda: self._send(path, referer, data, stream))
+        self.memo.invalidate(self.last_op, data)
+        return response
+
+    def _get(self, path, referer, params=None, op=None):
+        """
+        Gets the page at path with the query parameters params, with referer as
+        the Referer path, the same way as _post(). op names the operation in
+        statistics, path by default. The response body is not read up front.
+        """
+
+        self.last_op = "GET " + (op or path)
+        return self._send(path, referer, params, True, "get")
+
+    def _send(self, path, referer, data, stream, method="post"):
+        """ Sends a request for _post() or _get(), waiting for rate limits and retrying as needed. """
+        sent = len(urlencode(data or []))
+        repeatable = self.last_op not in CREATING_OPS
+        for attempt in range(self.max_retries + 1):
+            delay = self.parked.get(self.last_op, 0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+            if path in self.rate_limits:
+                self.rate_limits[path].acquire()
+
+            start = time.perf_counter()
+            try:
+                response = getattr(self.transport, method)(
+                    self.base_url + path, headers={
+                        "Referer": self.base_url + referer
+                    }, stream=stream, **({"data": data} if method == "post" else {"params": data})
+                )
+
+                error = None if response.ok else "HTTP " + str(response.status_code)
+                received = int(response.headers.get("Content-Length", 0)) if stream else len(response.content)
+                self.stats.record(self.last_op, time.perf_counter() - start, sent, received, error)
+                if response.status_code not in TRANSIENT_STATUSES or not repeatable or attempt == self.max_retries:
+                    return response
+
+                wait = _retry_after(response)
+
+            except OSError as e:
+                # Network errors, including requests' ConnectionError and Timeout, are worth
+                # retrying, but requests also raises invalid URLs and such as OSErrors
+                self.stats.record(self.last_op, time.perf_counter() - start, sent, 0, type(e).__name__)
+                if isinstance(e, ValueError) or attempt == self.max_retries or not (repeatable or _not_sent(e)):
+                    raise
+
+                wait = None
+
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt) if wait is None else wait)
+
+    def _error(self, code):
+        """ Records the error code against the last request and returns a ShadertoyError for it. """
+        self.stats.record(self.last_op, error=code.name)
+        return ShadertoyError(code)
+
+    def _park_quota(self, ops):
+        """
+        Parks the operations ops (e.g. "/comment comment") until the daily
+        quota resets, which is assumed to happen at midnight UTC. Other
+        requests to the same endpoint are not held up. Returns False without
+        parking if that is more than quota_wait seconds away.
+        """
+
+        now = time.time()
+        reset = (now // 86400 + 1) * 86400
+        if reset - now > self.quota_wait:
+            return False
+
+        for op in ops:
+            self.parked[op] = reset
+
+        return True
 
     def get_embeddable_url(self, shader_id, show_gui=True, start_time=10, paused=True, muted=False):
         """ Returns an embeddable URL for the given shader with the given settings. """
-        url = "https://www.shadertoy.com/embed/" + shader_id
+        url = self.base_url + "/embed/" + shader_id
         url += "?gui=" + ("true" if show_gui else "false")
         url += "&t=" + str(start_time)
         url += "&paused=" + ("true" if paused else "false")
@@ -186,86 +1504,293 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=shaders", [
                 ("gsibuifpt", "1"),
                 ("op", "true" if only_public else "false")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=shaders"
-            }
-        ).json()
+            ]
+        ).content)
 
         if response["result"] == 0:
             return response["shaderlist"]["id"]
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        raise self._error(ErrorCode.OPERATION_FAILED)
 
-    def get_shaders(self, shader_ids, include_tags=True, include_user_like=True, include_parent_info=True):
+    def get_shaders(self, shader_ids, include_tags=True, include_user_like=True, include_parent_info=True, revisions=None):
         """
         Based on getAllShaders()
         doExportShader() only gets one but does it in the same way.
         Returns a list of shaders encoded in JSON.
+        If the session has a cache, only shaders which are not cached or are
+        stale are requested. revisions optionally maps shader IDs to their
+        latest known info.date so that outdated cached copies are refetched.
         """
 
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        shader_ids = [*shader_ids]
+        options = ("1" if include_tags else "0") + ("1" if include_user_like else "0") + ("1" if include_parent_info else "0")
+        cached, missing = {}, shader_ids
+        if self.cache:
+            cached, missing = self.cache.get(shader_ids, options, revisions)
+            if not missing:
+                return [cached[shader_id] for shader_id in shader_ids]
+
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=shaders", [
+                ("s", json.dumps({"shaders": missing})),
+                ("nt", options[0]),
+                ("nl", options[1]),
+                ("np", options[2])
+            ]
+        ).content)
+
+        if not self.cache or not isinstance(response, list):
+            return response
+
+        self.cache.put(response, options)
+        for shader in response:
+            cached[shader["info"]["id"]] = shader
+
+        return [cached[shader_id] for shader_id in shader_ids if shader_id in cached]
+
+    def iter_shaders(self, shader_ids, include_tags=True, include_user_like=True, include_parent_info=True):
+        """
+        Streaming version of get_shaders() which yields the shaders one by one
+        while the response is being received and decoded, so that only one
+        shader is held in memory at once. Does not use the cache.
+        """
+
+        response = self._post(
+            "/shadertoy", "/profile/?show=shaders", [
                 ("s", json.dumps({"shaders": [*shader_ids]})),
                 ("nt", "1" if include_tags else "0"),
                 ("nl", "1" if include_user_like else "0"),
                 ("np", "1" if include_parent_info else "0")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=shaders"
-            }
-        ).json()
+            ], stream=True
+        )
 
-        return response
+        try:
+            yield from iter_json_array(response.iter_content(65536))
+
+        except ValueError:
+            raise self._error(ErrorCode.OPERATION_FAILED)
+
+        finally:
+            response.close()
+
+    def get_shaders_bulk(self, shader_ids, batch_size=50, workers=4, **kwargs):
+        """
+        Same as get_shaders() but for any number of shaders. shader_ids is split
+        into batches of batch_size which are fetched in parallel by workers
+        threads, each with its own clone() of this session.
+        Returns a tuple (shaders, failures). shaders is in the same order as
+        shader_ids, with None in place of every shader that could not be fetched.
+        failures is a list of (batch, exception) tuples, one per failed batch.
+        """
+
+        shader_ids = [*shader_ids]
+        batches = [shader_ids[i:i + batch_size] for i in range(0, len(shader_ids), batch_size)]
+
+        def fetch(member, batch):
+            shaders = member.get_shaders(batch, **kwargs)
+            if not isinstance(shaders, list):
+                raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+
+            return shaders
+
+        found = {}
+        failures = []
+        for batch, (shaders, error) in zip(batches, self._parallel(fetch, batches, workers)):
+            if error:
+                failures.append((batch, error))
+                continue
+
+            for shader in shaders:
+                found[shader["info"]["id"]] = shader
+
+        return [found.get(shader_id) for shader_id in shader_ids], failures
+
+    def iter_all_shaders(self, only_public=False, batch_size=50, **kwargs):
+        """
+        Streaming version of get_shaders(get_all_shaders()).
+        Yields shaders one at a time as they arrive, fetching batch_size of them
+        per request. Without a cache only one shader is held in memory at once,
+        with a cache one batch is.
+        """
+
+        shader_ids = self.get_all_shaders(only_public)
+        for i in range(0, len(shader_ids), batch_size):
+            if not self.cache:
+                yield from self.iter_shaders(shader_ids[i:i + batch_size], **kwargs)
+                continue
+
+            shaders = self.get_shaders(shader_ids[i:i + batch_size], **kwargs)
+            if not isinstance(shaders, list):
+                raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+
+            yield from shaders
+
+    def export_ndjson(self, file, only_public=False, batch_size=50):
+        """
+        Writes all shaders to file as newline delimited JSON, one shader per
+        line, as they are fetched. file is a path or a writable text stream.
+        Returns the number of shaders written.
+        """
+
+        if isinstance(file, str):
+            with open(file, "w", encoding="utf-8") as stream:
+                return self.export_ndjson(stream, only_public, batch_size)
+
+        count = 0
+        for shader in self.iter_all_shaders(only_public, batch_size):
+            file.write(json.dumps(shader, separators=(",", ":")) + "\n")
+            count += 1
+
+        return count
+
+    def sync_archive(self, path, only_public=False, revisions=None, refresh=False, batch_size=50, workers=4):
+        """
+        Mirrors all shaders into the local archive directory at path, fetching
+        only shaders which are new or changed since the last sync.
+
+        The archive holds one shaders/<id>.json file per shader and index.json,
+        which maps shader IDs to their info.date. Shaders which no longer exist
+        remotely are tombstoned in the index, their files are kept.
+        Shadertoy does not report modification dates with the shader list, so
+        archived shaders are only refetched if revisions (a dict mapping shader
+        IDs to their latest info.date) says they changed, or if refresh is True.
+
+        Returns the sync report, which is also written to sync_report.json.
+        """
+
+        start = time.time()
+        os.makedirs(os.path.join(path, "shaders"), exist_ok=True)
+        index = _read_archive_index(path)
+        remote_ids = self.get_all_shaders(only_public)
+        stale = _stale_ids(index, remote_ids, revisions, refresh)
+        report = {
+            "fetched": 0,
+            "skipped": len(remote_ids) - len(stale),
+            "deleted": 0,
+            "failed": 0,
+            "elapsed": 0.0
+        }
+
+        shaders = self.get_shaders_bulk(stale, batch_size, workers)[0]
+        for shader in shaders:
+            if shader is None:
+                report["failed"] += 1
+                continue
+
+            shader_id = shader["info"]["id"]
+            _write_archive_shader(path, shader)
+            index[shader_id] = {"date": int(shader["info"].get("date", 0))}
+            report["fetched"] += 1
+
+        report["deleted"] = _tombstone(index, remote_ids, start)
+
+        # Write the index last so an interrupted sync is simply redone
+        _write_archive_index(path, index)
+
+        report["elapsed"] = round(time.time() - start, 3)
+        with open(os.path.join(path, "sync_report.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+        return report
 
     def upload_shader(self, shader_json, shader_icon=None, is_update=False, is_fork=False):
         """
         Based on openSubmitShaderForm()
+        shader_json is the shader encoded in JSON or a Shader.
+        shader_icon is an open image file, which is closed afterwards,
+        a path or a data URL as returned by icon_data_url().
         Returns the ID assigned by shadertoy to the shader.
         """
 
         self.require_signin()
+        if isinstance(shader_json, Shader):
+            shader_json = shader_json.to_json()
+
         payload = [
             ("f" if is_fork else ("u" if is_update else "a"), json.dumps(shader_json))
         ]
 
         if shader_icon:
-            with shader_icon:
-                ext = shader_icon.name[shader_icon.name.rfind(".")+1:]
-                data = base64.b64encode(shader_icon.read()).decode("utf-8")
-                data_url = "data:image/" + ext + ";base64," + data
-                payload.append(("ss", data_url))
-
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy",
-            data=payload, headers={
-                "Referer": "https://www.shadertoy.com/new"
-            }
-        ).json()
+            if not (isinstance(shader_icon, str) and shader_icon.startswith("data:")):
+                shader_icon = icon_data_url(shader_icon)
+
+            payload.append(("ss", shader_icon))
+
+        response = _loads(self._post("/shadertoy", "/new", payload).content)
+        reauthenticated = False
+        while True:
+            if response["result"] == -16 and self._park_quota(["/shadertoy a", "/shadertoy u", "/shadertoy f"]):
+                pass
+
+            # Restored sessions are only checked now
+            elif response["result"] == -3 and not reauthenticated and self._reauthenticate():
+                reauthenticated = True
+
+            else:
+                break
+
+            response = _loads(self._post("/shadertoy", "/new", payload).content)
 
         # Error codes used by shaderSaved()
         error_code = response["result"]
         if error_code == 0:
+            if is_update and self.cache:
+                self.cache.invalidate([response["id"]])
+
             return response["id"]
 
         if error_code == -2:
-            raise ShadertoyError(ErrorCode.NAME_ALREADY_USED)
+            raise self._error(ErrorCode.NAME_ALREADY_USED)
 
         if error_code == -3:
-            raise ShadertoyError(ErrorCode.SESSION_EXPIRED)
+            raise self._error(ErrorCode.SESSION_EXPIRED)
 
         if error_code == -13:
-            raise ShadertoyError(ErrorCode.USES_PRIVATE_ASSETS)
+            raise self._error(ErrorCode.USES_PRIVATE_ASSETS)
 
         if error_code == -15:
-            raise ShadertoyError(ErrorCode.ACCOUNT_UNVERIFIED)
+            raise self._error(ErrorCode.ACCOUNT_UNVERIFIED)
 
         if error_code == -16:
-            raise ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED)
+            raise self._error(ErrorCode.DAILY_QUOTA_REACHED)
+
+        raise self._error(ErrorCode.OPERATION_FAILED)
+
+    def upload_shaders(self, uploads, workers=4):
+        """
+        Uploads many shaders concurrently. uploads is a list of dicts with the
+        arguments of upload_shader().
+        Each of the workers threads encodes an icon and uploads its shader in
+        turn with its own clone() of this session, so encoding overlaps with
+        the other uploads and at most workers encoded icons are held at once.
+        Returns a list in the same order as uploads of dicts with "id", the
+        assigned shader ID or None, and "error", the ErrorCode or None.
+        Errors which are not a ShadertoyError are reported as
+        ErrorCode.OPERATION_FAILED with the exception under "exception".
+        """
+
+        def upload(member, kwargs):
+            kwargs = dict(kwargs)
+            icon = kwargs.get("shader_icon")
+            if icon and not (isinstance(icon, str) and icon.startswith("data:")):
+                kwargs["shader_icon"] = icon_data_url(icon)
+
+            return member.upload_shader(**kwargs)
+
+        results = []
+        for shader_id, error in self._parallel(upload, uploads, workers):
+            if error is None:
+                results.append({"id": shader_id, "error": None})
+            elif isinstance(error, ShadertoyError):
+                results.append({"id": None, "error": error.code})
+            else:
+                results.append({"id": None, "error": ErrorCode.OPERATION_FAILED, "exception": error})
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        return results
 
     def delete_shader(self, shader_id):
         """
@@ -274,14 +1799,15 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=shaders", [
                 ("s", shader_id),
                 ("d", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=shaders"
-            }
-        ).json()
+            ], op="d"
+        ).content)
+
+        if self.cache:
+            self.cache.invalidate([shader_id])
 
         return response == 0
 
@@ -292,14 +1818,16 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("s", shader_id),
                 ("l", "1" if like else "0")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ], op="l"
+        ).content)
+
+        # Cached copies have the old likes and hasliked
+        if self.cache:
+            self.cache.invalidate([shader_id])
 
         return response == True or response["result"] == 0
 
@@ -309,14 +1837,12 @@ class ShadertoySession:
         Returns a bool determining whether the operation succeeded or failed.
         """
 
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("s", shader_id),
                 ("r", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ], op="r"
+        ).content)
 
         return response["result"] == 0
 
@@ -326,14 +1852,12 @@ class ShadertoySession:
         Returns a bool determining whether the operation succeeded or failed.
         """
 
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("s", shader_id),
                 ("r", "2")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ], op="r"
+        ).content)
 
         return response["result"] == 0
 
@@ -348,14 +1872,12 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("psg", "1"),
                 ("sid", shader_id)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ]
+        ).content)
 
         # Shadertoy seems to just ignore this field
         #if response["result"] != 0:
@@ -372,15 +1894,13 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("pas", "1"),
                 ("pid", playlist_id),
                 ("sid", shader_id)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ]
+        ).content)
 
         return response["result"] == 0
 
@@ -393,15 +1913,13 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/view/" + shader_id, [
                 ("prs", "1"),
                 ("pid", playlist_id),
                 ("sid", shader_id)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ]
+        ).content)
 
         return response["result"] == 0
 
@@ -411,13 +1929,46 @@ class ShadertoySession:
         Returns the comments section on the given shader encoded in JSON.
         """
 
-        return self.session.post(
-            "https://www.shadertoy.com/comment", data=[
+        return _loads(self._post(
+            "/comment", "/view/" + shader_id, [
                 ("s", shader_id)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ]
+        ).content)
+
+    def get_comments_bulk(self, shader_ids, workers=8, cache=None):
+        """
+        Fetches the comments of many shaders concurrently.
+        With a CommentCache, threads whose hash matches the cached one are
+        skipped without being decoded, so only changed threads are returned.
+        Returns a tuple (changed, failures) of dicts mapping shader IDs to
+        their new or changed comments and to the exception fetching them
+        raised, respectively.
+        """
+
+        shader_ids = [*shader_ids]
+        known = cache.hashes(shader_ids) if cache else {}
+
+        def fetch(member, shader_id):
+            content = member._post("/comment", "/view/" + shader_id, [("s", shader_id)]).content
+            digest = hashlib.sha256(content).hexdigest()
+            if known.get(shader_id) == digest:
+                return None
+
+            comments = _loads(content)
+            if cache:
+                cache.put(shader_id, digest, comments)
+
+            return comments
+
+        changed = {}
+        failures = {}
+        for shader_id, (comments, error) in zip(shader_ids, self._parallel(fetch, shader_ids, workers)):
+            if error:
+                failures[shader_id] = error
+            elif comments is not None:
+                changed[shader_id] = comments
+
+        return changed, failures
 
     def post_comment(self, shader_id, comment):
         """
@@ -426,26 +1977,26 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/comment", data=[
-                ("s", shader_id),
-                ("comment", comment)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+        payload = [
+            ("s", shader_id),
+            ("comment", comment)
+        ]
+
+        response = _loads(self._post("/comment", "/view/" + shader_id, payload, op="comment").content)
+        while response["added"] == -3 and self._park_quota(["/comment comment"]):
+            response = _loads(self._post("/comment", "/view/" + shader_id, payload, op="comment").content)
 
         error_code = response["added"]
         if error_code > 0:
             return response
 
         if error_code == -1:
-            raise ShadertoyError(ErrorCode.ACCOUNT_UNVERIFIED)
+            raise self._error(ErrorCode.ACCOUNT_UNVERIFIED)
 
         if error_code == -3:
-            raise ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED)
+            raise self._error(ErrorCode.DAILY_QUOTA_REACHED)
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        raise self._error(ErrorCode.OPERATION_FAILED)
 
     def set_comment_visibility(self, shader_id, comment_id, visible=True):
         """
@@ -454,15 +2005,13 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/comment", data=[
+        response = _loads(self._post(
+            "/comment", "/view/" + shader_id, [
                 ("s", shader_id),
                 ("c", comment_id),
                 ("hide", "0" if visible else "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/view/" + shader_id
-            }
-        ).json()
+            ], op="hide"
+        ).content)
 
         return response["hide"] != 0
 
@@ -473,13 +2022,11 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=playlists", [
                 ("pg", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=playlists"
-            }
-        ).json()
+            ]
+        ).content)
 
         # Shadertoy seems to just ignore this field
         #if response["result"] != 0:
@@ -487,9 +2034,52 @@ class ShadertoySession:
 
         return response["playlists"]
 
-    def get_shaders_in_playlist(self, playlist_id):
-        # Appears that we'll have to do this with some scraping
-        raise NotImplementedError
+    def get_shaders_in_playlist(self, playlist_id, page_size=100, workers=4, fetch_shaders=False, batch_size=50):
+        """
+        Based on the playlist page, scraping its gShaderIDs array
+        Returns a list of the IDs of the shaders in the playlist, or if
+        fetch_shaders is True, the shaders encoded in JSON, fetched with
+        get_shaders_bulk() in batches of batch_size.
+        Pages of page_size shaders are fetched up to workers at a time.
+        """
+
+        path = "/playlist/" + playlist_id
+
+        def fetch(member, start):
+            response = member._get(path, path, [("from", start), ("num", page_size)], op="/playlist")
+            if not response.ok:
+                response.close()
+                raise member._error(ErrorCode.OPERATION_FAILED)
+
+            return _parse_page(response, ["gShaderIDs"]).arrays.get("gShaderIDs", [])
+
+        # Small playlists fit on the first page, so only fetch more once it is full
+        shader_ids = fetch(self, 0)
+        seen = set(shader_ids)
+        complete = len(shader_ids) < page_size
+        while not complete:
+            starts = [len(shader_ids) + i * page_size for i in range(workers)]
+            for page, error in self._parallel(fetch, starts, workers):
+                if error is not None:
+                    raise error
+
+                if complete:
+                    continue
+
+                # A page with nothing new means from is not honoured, so stop rather than loop forever
+                new = [shader_id for shader_id in page if shader_id not in seen]
+                seen.update(new)
+                shader_ids += new
+                complete = len(page) < page_size or not new
+
+        if not fetch_shaders:
+            return shader_ids
+
+        shaders, failures = self.get_shaders_bulk(shader_ids, batch_size, workers)
+        if failures:
+            raise failures[0][1]
+
+        return [shader for shader in shaders if shader is not None]
 
     def create_playlist(self, name, description, privacy=PlaylistPrivacy.PRIVATE):
         """
@@ -498,21 +2088,19 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=playlists", [
                 ("pa", "1"),
                 ("name", name),
                 ("description", description),
                 ("published", privacy.value)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=playlists"
-            }
-        ).json()
+            ]
+        ).content)
 
         if response["result"] == 0:
             return response["id"]
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        raise self._error(ErrorCode.OPERATION_FAILED)
 
     def set_playlist_metadata(self, playlist_id, name, description, privacy):
         """
@@ -521,17 +2109,15 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=playlists", [
                 ("pu", "1"),
                 ("pua", playlist_id),
                 ("name", name),
                 ("description", description),
                 ("published", privacy.value)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=playlists"
-            }
-        ).json()
+            ]
+        ).content)
 
         return response["result"] == 0
 
@@ -542,14 +2128,12 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=playlists", [
                 ("pd", "1"),
                 ("pda", playlist_id)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=playlists"
-            }
-        ).json()
+            ]
+        ).content)
 
         return response["result"] == 0
 
@@ -560,13 +2144,11 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=notifications", [
                 ("ng", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=notifications"
-            }
-        ).json()
+            ]
+        ).content)
 
         # Shadertoy seems to just ignore this field
         #if response["result"] != 0:
@@ -583,19 +2165,17 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=social", [
                 ("fcg", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=social"
-            }
-        ).json()
+            ]
+        ).content)
 
         if response["result"] == 0:
             del response["result"]
             return response
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        raise self._error(ErrorCode.OPERATION_FAILED)
 
     def set_following(self, user, follow=True):
         """
@@ -606,20 +2186,31 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        response = self.session.post(
-            "https://www.shadertoy.com/shadertoy", data=[
+        response = _loads(self._post(
+            "/shadertoy", "/profile/?show=social", [
                 ("fs" if follow else "fu", "1"),
                 ("uid", user)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/profile/?show=social"
-            }
-        ).json()
+            ]
+        ).content)
 
         return response["result"] == 0
 
     def get_apps(self):
-        # Appears that we'll have to do this with some scraping
-        raise NotImplementedError
+        """
+        Based on the table of the myapps page
+        Returns a list with a dict for each app, mapping the table's lowercase
+        column names to the app's cells.
+        """
+
+        self.require_signin()
+        response = self._get("/myapps", "/myapps")
+        if not response.ok:
+            response.close()
+            raise self._error(ErrorCode.OPERATION_FAILED)
+
+        page = _parse_page(response)
+        columns = [name.lower() for name in page.header]
+        return [dict(zip(columns, row)) for row in page.rows]
 
     def create_app(self, name, description):
         """
@@ -628,23 +2219,21 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        error_code = self.session.post(
-            "https://www.shadertoy.com/myapps", data=[
+        error_code = _loads(self._post(
+            "/myapps", "/myapps", [
                 ("a", "1"),
                 ("name", name),
                 ("desc", description)
-            ], headers={
-                "Referer": "https://www.shadertoy.com/myapps"
-            }
-        ).json()
+            ]
+        ).content)
 
         if error_code == 0:
             return
 
         if error_code == -2:
-            raise ShadertoyError(ErrorCode.NAME_ALREADY_USED)
+            raise self._error(ErrorCode.NAME_ALREADY_USED)
 
-        raise ShadertoyError(ErrorCode.OPERATION_FAILED)
+        raise self._error(ErrorCode.OPERATION_FAILED)
 
     def delete_app(self, app_key):
         """
@@ -653,13 +2242,926 @@ class ShadertoySession:
         """
 
         self.require_signin()
-        error_code = self.session.post(
-            "https://www.shadertoy.com/myapps", data=[
+        error_code = _loads(self._post(
+            "/myapps", "/myapps", [
                 ("id", app_key),
                 ("d", "1")
-            ], headers={
-                "Referer": "https://www.shadertoy.com/myapps"
+            ], op="d"
+        ).content)
+
+        return error_code == 0
+
+class Watcher:
+    """
+    Polls the notifications of a session, or the comments of shader_id if
+    given, and reports only new events. Each event is a dict with "type",
+    a NotificationType (always POST for comments), and "data", the decoded
+    notification or comment.
+
+    Unchanged responses are recognized by their hash and not decoded.
+    The polling interval starts at min_interval, is multiplied by backoff
+    after every poll without new events, up to max_interval, and goes back
+    to min_interval once something happens. Polls which fail back off the
+    same way, their number is kept in errors and the last one in last_error.
+
+    >>> watcher = Watcher(session)
+    >>> watcher.run(print)
+    >>> async for event in Watcher(session, shader_id).events():
+    ...     print(event["data"]["text"])
+    """
+
+    def __init__(self, session, shader_id=None, min_interval=15, max_interval=600, backoff=1.5):
+        self.session = session
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self.digest = None
+        self.seen = None
+        self.errors = 0
+        self.last_error = None
+
+        if shader_id is None:
+            session.require_signin()
+            self.request = ("/shadertoy", "/profile/?show=notifications", [("ng", "1")])
+        else:
+            self.request = ("/comment", "/view/" + shader_id, [("s", shader_id)])
+
+    def _items(self, payload):
+        if self.request[0] == "/shadertoy":
+            payload = payload["notifications"]
+
+        # Comments, and possibly notifications, come as a dict of columns
+        if isinstance(payload, dict):
+            columns = {k: v for k, v in payload.items() if isinstance(v, list)}
+            count = min(map(len, columns.values()), default=0)
+            return [{k: v[i] for k, v in columns.items()} for i in range(count)]
+
+        return payload or []
+
+    def poll(self):
+        """
+        Fetches once and returns the list of new events. The first poll only
+        records what is there already and returns nothing.
+        """
+
+        content = self.session._post(*self.request).content
+        digest = hashlib.sha256(content).digest()
+        events = []
+        if digest != self.digest:
+            seen = {}
+            for item in self._items(_loads(content)):
+                seen[hashlib.sha256(json.dumps(item, sort_keys=True).encode("utf-8")).digest()] = item
+
+            # Only once decoded, so that a payload which could not be is tried again
+            self.digest = digest
+
+            if self.seen is not None:
+                for key, item in seen.items():
+                    if key not in self.seen:
+                        try:
+                            kind = NotificationType(item.get("type", 1))
+                        except ValueError:
+                            kind = None
+
+                        events.append({"type": kind, "data": item})
+
+            self.seen = set(seen)
+
+        if events:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+
+        return events
+
+    def _poll_or_back_off(self):
+        """ Polls like poll(), but returns no events and backs off if the poll fails. """
+        try:
+            events = self.poll()
+        except Exception as e:
+            self.errors += 1
+            self.last_error = e
+            self.interval = min(self.max_interval, self.interval * self.backoff)
+            return []
+
+        self.last_error = None
+        return events
+
+    def run(self, callback, stop=None):
+        """
+        Polls until stop (a threading.Event) is set, calling callback with
+        every new event.
+        """
+
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            for event in self._poll_or_back_off():
+                callback(event)
+
+            stop.wait(self.interval)
+
+    async def events(self):
+        """ Async iterator over new events, polling on a worker thread. """
+        import asyncio
+
+        while True:
+            for event in await asyncio.to_thread(self._poll_or_back_off):
+                yield event
+
+            await asyncio.sleep(self.interval)
+
+class AsyncShadertoySession:
+    """
+    asyncio counterpart of ShadertoySession. Every method of ShadertoySession
+    is available as a coroutine taking the same arguments, generator methods
+    such as iter_shaders() as async generators.
+
+    Requests are run on a pool of max_concurrency blocking sessions sharing
+    one cookie jar, so at most max_concurrency requests are in flight at once
+    and each of them reuses a kept-alive connection. Other keyword arguments
+    are passed on to ShadertoySession.
+    """
+
+    def __init__(self, max_concurrency=8, **kwargs):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.primary = ShadertoySession(pool_size=1, **kwargs)
+        self.members = [self.primary] + [self.primary.clone() for _ in range(max_concurrency - 1)]
+        self.executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="shadertoy")
+        self.idle = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def signed_in(self):
+        return self.primary.signed_in
+
+    async def _acquire(self):
+        import asyncio
+
+        # The idle queue has to be created inside the running event loop
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+            for member in self.members:
+                self.idle.put_nowait(member)
+
+        return await self.idle.get()
+
+    async def _call(self, function):
+        """ Calls function(member) on a worker thread with an idle member and returns its result. """
+        import asyncio
+
+        member = await self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, function, member)
+        finally:
+            self.idle.put_nowait(member)
+
+    async def _run(self, name, *args, **kwargs):
+        return await self._call(lambda member: getattr(member, name)(*args, **kwargs))
+
+    async def _iterate(self, name, *args, **kwargs):
+        """
+        Iterates over the generator method name of a member on worker threads,
+        keeping the member to itself until the iteration is done.
+        """
+
+        import asyncio
+
+        member = await self._acquire()
+        loop = asyncio.get_running_loop()
+        iterator = getattr(member, name)(*args, **kwargs)
+        done = object()
+        try:
+            while True:
+                item = await loop.run_in_executor(self.executor, next, iterator, done)
+                if item is done:
+                    return
+
+                yield item
+
+        finally:
+            await loop.run_in_executor(self.executor, iterator.close)
+            self.idle.put_nowait(member)
+
+    def __getattr__(self, name):
+        function = getattr(ShadertoySession, name, None)
+        if name.startswith("_") or not callable(function):
+            raise AttributeError(name)
+
+        import inspect
+
+        # Generators such as iter_shaders() become async generators
+        if inspect.isgeneratorfunction(function):
+            def method(*args, **kwargs):
+                return self._iterate(name, *args, **kwargs)
+        else:
+            async def method(*args, **kwargs):
+                return await self._run(name, *args, **kwargs)
+
+        method.__name__ = name
+        method.__doc__ = getattr(ShadertoySession, name).__doc__
+        return method
+
+    async def signin(self, username, password):
+        """ Signs into shadertoy with the given username and password. """
+        signed_in = await self._call(lambda member: (member.signin(username, password), member)[1])
+        for member in self.members:
+            member.signed_in = True
+            member.credentials = signed_in.credentials
+
+    async def signout(self):
+        """ Signs out of shadertoy. """
+        await self._run("signout")
+        for member in self.members:
+            member.signed_in = False
+            member.credentials = None
+
+    async def load_state(self, path, username=None, password=None):
+        """ Restores the cookies and signin state saved by save_state(). """
+        # Whichever member restores the state, the others take it from that one
+        restored, loaded = await self._call(lambda member: (member.load_state(path, username, password), member))
+        for member in self.members:
+            member.signed_in = loaded.signed_in
+            member.credentials = loaded.credentials
+            member.state_path = loaded.state_path
+
+        return restored
+
+    async def close(self):
+        """ Closes every pooled session and the worker threads. """
+        for member in self.members:
+            member.close()
+
+        self.executor.shutdown(wait=False)
+
+class SessionPool:
+    """
+    Pool of signed in sessions for many worker threads, possibly spread over
+    several accounts to get past the throughput and daily quota of one.
+
+    Each account gets sessions_per_account sessions sharing its cookies. A
+    session is handed out to one thread at a time, taken from the account
+    that has made the fewest calls so far and has not reached its daily
+    quota. Accounts whose cookies have expired are signed in again before
+    their sessions are handed out, as are accounts a call failed with
+    ErrorCode.SESSION_EXPIRED for. Without accounts the pool holds anonymous
+    sessions. Other keyword arguments are passed on to ShadertoySession.
+
+    Responses differ between accounts, so each account gets its own
+    ResponseMemo, with the TTLs and size of memo if one is passed. A
+    ShaderCache can only be used with a single account.
+
+    >>> pool = SessionPool([("alice", "password"), ("bob", "password")])
+    >>> with pool.session() as session:
+    ...     session.set_shader_like(shader_id)
+    >>> results = pool.map(lambda session, upload: session.upload_shader(**upload), uploads)
+    """
+
+    def __init__(self, accounts=(), sessions_per_account=4, health_interval=300, **kwargs):
+        self.health_interval = health_interval
+        self.condition = threading.Condition()
+        kwargs.setdefault("stats", RequestStats())
+        self.stats = kwargs["stats"]
+
+        accounts = list(accounts) or [None]
+        if kwargs.get("cache") and len(accounts) > 1:
+            raise ValueError("a ShaderCache can't be shared by several accounts")
+
+        # One dict per account, its sessions and its bookkeeping
+        self.accounts = []
+        memo = kwargs.pop("memo", None)
+        for credentials in accounts:
+            if memo:
+                kwargs["memo"] = ResponseMemo(memo.ttls, memo.max_entries)
+
+            primary = ShadertoySession(pool_size=1, **kwargs)
+            if credentials:
+                primary.signin(*credentials)
+
+            members = [primary] + [primary.clone() for _ in range(sessions_per_account - 1)]
+            self.accounts.append({
+                "primary": primary,
+                "members": members,
+                "idle": list(members),
+                "calls": 0,
+                "checked": time.time(),
+                "signin_lock": threading.Lock(),
+                "exhausted": 0
+            })
+
+        self.owners = {id(member): account for account in self.accounts for member in account["members"]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return sum(len(account["members"]) for account in self.accounts)
+
+    def acquire(self, timeout=None):
+        """
+        Returns a session for the calling thread's exclusive use, waiting up
+        to timeout seconds for one to be released. Give it back with release().
+        Raises ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED) if every account
+        has reached its daily quota.
+        """
+
+        with self.condition:
+            while True:
+                now = time.time()
+                usable = [account for account in self.accounts if account["exhausted"] <= now]
+                if not usable:
+                    raise ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED)
+
+                ready = [account for account in usable if account["idle"]]
+                if ready:
+                    account = min(ready, key=lambda account: account["calls"])
+                    account["calls"] += 1
+                    member = account["idle"].pop()
+                    break
+
+                if not self.condition.wait(timeout):
+                    raise TimeoutError("no session was released in time")
+
+        try:
+            self._check(account, member)
+        except Exception:
+            self.release(member)
+            raise
+
+        return member
+
+    def release(self, member, error=None):
+        """
+        Returns a session taken with acquire() to the pool. error is the
+        exception the caller's work with it failed with, if any, so that
+        expired signins and reached quotas are dealt with.
+        """
+
+        account = self.owners[id(member)]
+        if isinstance(error, ShadertoyError):
+            if error.code == ErrorCode.SESSION_EXPIRED:
+                account["checked"] = 0
+
+            elif error.code == ErrorCode.DAILY_QUOTA_REACHED:
+                # Assumed to reset at midnight UTC, like ShadertoySession._park_quota()
+                account["exhausted"] = (time.time() // 86400 + 1) * 86400
+
+        with self.condition:
+            account["idle"].append(member)
+            self.condition.notify()
+
+    def _check(self, account, member):
+        """
+        Signs the account in again with member, a session just acquired from
+        it, if it is due a health check and its cookies have expired.
+        """
+
+        primary = account["primary"]
+        if not primary.credentials or time.time() - account["checked"] < self.health_interval:
+            return
+
+        # Several threads may find the account due, only one signs in again
+        # while the others wait for it to be done
+        with account["signin_lock"]:
+            if time.time() - account["checked"] < self.health_interval:
+                return
+
+            # A checked time of 0 means a call already found the signin expired
+            cookies = list(primary.cookies)
+            if account["checked"] == 0 or not cookies or any(cookie.is_expired() for cookie in cookies):
+                # The other sessions may be in use, but they share member's cookies
+                member._reauthenticate()
+                for other in account["members"]:
+                    other.signed_in = True
+
+            account["checked"] = time.time()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """ Context manager acquiring a session and releasing it afterwards. """
+        member = self.acquire(timeout)
+        try:
+            yield member
+        except Exception as e:
+            self.release(member, e)
+            raise
+        else:
+            self.release(member)
+
+    def map(self, function, items, workers=None):
+        """
+        Calls function(session, item) for every item on up to workers threads,
+        by default one per session in the pool. An item failing because its
+        account's signin expired or quota ran out is retried once on another
+        session. Returns a list of (result, exception) tuples in the same
+        order as items.
+        """
+
+        def call(item):
+            for attempt in range(2):
+                try:
+                    with self.session() as member:
+                        return function(member, item), None
+
+                except ShadertoyError as e:
+                    retry = e.code in (ErrorCode.SESSION_EXPIRED, ErrorCode.DAILY_QUOTA_REACHED)
+                    if attempt or not retry:
+                        return None, e
+
+                except Exception as e:
+                    return None, e
+
+        items = list(items)
+        if not items:
+            return []
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(min(workers or len(self), len(items))) as executor:
+            return list(executor.map(call, items))
+
+    def close(self):
+        """ Signs out of every account and closes every session. """
+        for account in self.accounts:
+            if account["primary"].signed_in:
+                account["primary"].signout()
+
+            for member in account["members"]:
+                member.close()
+
+class MutationQueue:
+    """
+    Buffers likes, follows and playlist edits to send them all at once.
+    Only the last operation queued on the same target is sent, e.g. an unlike
+    after a like leaves the shader unliked. Before flushing, the playlists of
+    every shader with queued edits are fetched with one
+    get_shader_playlist_stats() call per shader, so that edits which would
+    not change anything are skipped.
+
+    >>> mutations = MutationQueue(session)
+    >>> for shader_id in shader_ids:
+    ...     mutations.like(shader_id)
+    ...     mutations.add_to_playlist(shader_id, playlist_id)
+    >>> results = mutations.flush(workers=8)
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+
+        # Maps (kind, target) to whether to do or undo it, the last one queued wins
+        self.pending = {}
+
+        # ((kind, target), value) of every operation queued since the last flush
+        self.queued = []
+
+        # Number of operations superseded by a later one on the same target so far
+        self.elided = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def _queue(self, key, value):
+        with self.lock:
+            if key in self.pending:
+                self.elided += 1
+
+            self.pending[key] = value
+            self.queued.append((key, value))
+
+    def like(self, shader_id, like=True):
+        self._queue(("like", shader_id), like)
+
+    def follow(self, user, follow=True):
+        self._queue(("follow", user), follow)
+
+    def add_to_playlist(self, shader_id, playlist_id):
+        self._queue(("playlist", (shader_id, playlist_id)), True)
+
+    def remove_from_playlist(self, shader_id, playlist_id):
+        self._queue(("playlist", (shader_id, playlist_id)), False)
+
+    def flush(self, workers=4):
+        """
+        Sends every queued operation on up to workers threads and empties the
+        queue. Returns a list of dicts in the order the operations were queued
+        with "kind" ("like", "follow" or "playlist"), "target" (shader ID, user
+        or (shader ID, playlist ID)), "value" (False to undo), "ok", the bool
+        returned by the ShadertoySession method or None if it raised, "error",
+        the exception raised or None, "skipped", True for operations which
+        were not sent, and "elided", True for those which were not sent
+        because a later operation on the same target superseded them.
+        Playlist edits are skipped too if the shader already was (or was not)
+        in the playlist.
+        """
+
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            queued, self.queued = self.queued, []
+
+        # Fetch the playlists of each shader once, which also shows whether it was found
+        shader_ids = list(dict.fromkeys(target[0] for kind, target in pending if kind == "playlist"))
+        memberships = {}
+        stats = self.session._parallel(lambda member, shader_id: member.get_shader_playlist_stats(shader_id),
+                                       shader_ids, workers)
+        for shader_id, (playlists, error) in zip(shader_ids, stats):
+            if error is None:
+                memberships[shader_id] = dict(zip(playlists["id"], playlists["exists"]))
+
+        latest = {}
+        unsent = []
+        for (kind, target), value in pending.items():
+            result = {
+                "kind": kind, "target": target, "value": value, "ok": None, "error": None, "skipped": False,
+                "elided": False
             }
-        ).json()
 
-        return error_code == 0e
\ No newline at end of file
+            if kind == "playlist":
+                membership = memberships.get(target[0], {})
+                if target[1] in membership and bool(membership[target[1]]) == value:
+                    result.update(ok=True, skipped=True)
+                else:
+                    unsent.append(result)
+            else:
+                unsent.append(result)
+
+            latest[kind, target] = result
+
+        # Operations superseded by a later one are reported where they were queued
+        results = []
+        seen = set()
+        for key, value in reversed(queued):
+            if key in seen:
+                results.append({
+                    "kind": key[0], "target": key[1], "value": value, "ok": True, "error": None, "skipped": True,
+                    "elided": True
+                })
+            else:
+                seen.add(key)
+                results.append(latest[key])
+
+        results.reverse()
+
+        def send(member, result):
+            if result["kind"] == "like":
+                return member.set_shader_like(result["target"], result["value"])
+
+            if result["kind"] == "follow":
+                return member.set_following(result["target"], result["value"])
+
+            if result["value"]:
+                return member.add_shader_to_playlist(*result["target"])
+
+            return member.remove_shader_from_playlist(*result["target"])
+
+        for result, (ok, error) in zip(unsent, self.session._parallel(send, unsent, workers)):
+            result.update(ok=ok, error=error)
+
+        return results
+
+class _Progress:
+    """ Progress line with throughput and ETA on stderr for main(). """
+
+    def __init__(self, label, total, done=0, quiet=False):
+        self.label = label
+        self.total = total
+        self.done = done
+        self.initial = done
+        self.quiet = quiet
+        self.start = time.perf_counter()
+        self.shown = 0
+
+    def update(self, count):
+        self.done += count
+        now = time.perf_counter()
+        if self.quiet or (now - self.shown < 0.5 and self.done < self.total):
+            return
+
+        self.shown = now
+        rate = (self.done - self.initial) / max(now - self.start, 1e-9)
+        eta = int((self.total - self.done) / rate) if rate else 0
+        sys.stderr.write("\r{} {}/{} {:.1f}/s ETA {}:{:02}:{:02} ".format(
+            self.label, self.done, self.total, rate, eta // 3600, eta // 60 % 60, eta % 60
+        ))
+
+        if self.done >= self.total:
+            sys.stderr.write("\n")
+
+        sys.stderr.flush()
+
+def _read_checkpoint(path):
+    """
+    Returns the shader IDs, the set of IDs done and the last output size
+    recorded in the checkpoint file at path, or None if there is none.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split("\n")
+
+    try:
+        shader_ids = json.loads(lines[0])
+    except ValueError:
+        return None
+
+    done = set()
+    size = 0
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # The last line may have been cut short by an interruption
+            break
+
+        done.update(entry["done"])
+        size = entry["size"]
+
+    return shader_ids, done, size
+
+def _fetch_checkpointed(session, args, label, checkpoint_path, list_ids, store, start=None):
+    """
+    Fetches shaders in batches on args.workers threads, resuming from the
+    checkpoint file at checkpoint_path if there is one. list_ids() returns
+    the IDs to fetch when starting afresh and start(resumed_size) is called
+    before fetching. store(shader) saves a shader and returns the size of the
+    output so far, which is recorded with every batch so that output written
+    after the last recorded batch can be dropped when resuming.
+    Returns the number of shaders which could not be fetched. The checkpoint
+    is removed once every shader has been fetched.
+    """
+
+    checkpoint = None if args.restart else _read_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        shader_ids = list(list_ids())
+        done, size = set(), None
+        with open(checkpoint_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(shader_ids) + "\n")
+    else:
+        shader_ids, done, size = checkpoint
+
+    if start:
+        start(size)
+
+    size = size or 0
+
+    remaining = [shader_id for shader_id in shader_ids if shader_id not in done]
+    batches = [remaining[i:i + args.batch_size] for i in range(0, len(remaining), args.batch_size)]
+    progress = _Progress(label, len(shader_ids), len(shader_ids) - len(remaining), args.quiet)
+    failed = 0
+
+    with open(checkpoint_path, "a", encoding="utf-8") as log:
+        def batch_done(batch, shaders, error):
+            nonlocal failed, size
+            if error is not None or not isinstance(shaders, list):
+                failed += len(batch)
+                return
+
+            for shader in shaders:
+                size = store(shader)
+
+            # Only record the batch once its shaders are safely written
+            log.write(json.dumps({"done": batch, "size": size}) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+            progress.update(len(batch))
+
+        session._parallel(lambda member, batch: member.get_shaders(batch), batches, args.workers, batch_done)
+
+    if not failed:
+        os.remove(checkpoint_path)
+    elif not args.quiet:
+        sys.stderr.write("\n{} shaders failed, run again to resume\n".format(failed))
+
+    return failed
+
+def _export(session, args, path, list_ids):
+    """ Exports shaders to the NDJSON file at path for main(). """
+    output = None
+
+    def start(size):
+        nonlocal output
+        # Drop anything written after the last batch recorded in the checkpoint
+        output = open(path, "r+b" if size is not None and os.path.exists(path) else "wb")
+        output.truncate(size or 0)
+        output.seek(size or 0)
+
+    def store(shader):
+        output.write(json.dumps(shader, separators=(",", ":")).encode("utf-8") + b"\n")
+        output.flush()
+        return output.tell()
+
+    try:
+        return _fetch_checkpointed(session, args, "export", path + ".checkpoint", list_ids, store, start)
+    finally:
+        if output:
+            output.close()
+
+def _mirror(session, args, root, list_ids):
+    """
+    Mirrors shaders into the archive directory root for main(), fetching only
+    new shaders, and tombstoning those which no longer exist unless args.ids
+    are given, as sync_archive() does.
+    """
+
+    os.makedirs(os.path.join(root, "shaders"), exist_ok=True)
+    index = _read_archive_index(root)
+
+    def list_stale():
+        remote_ids = list(list_ids())
+        if not args.ids and _tombstone(index, remote_ids, time.time()):
+            _write_archive_index(root, index)
+
+        return _stale_ids(index, remote_ids)
+
+    def store(shader):
+        _write_archive_shader(root, shader)
+        index[shader["info"]["id"]] = {"date": int(shader["info"].get("date", 0))}
+        return 0
+
+    failed = _fetch_checkpointed(session, args, "mirror", os.path.join(root, "mirror.checkpoint"), list_stale, store)
+
+    # Shaders fetched in an earlier, interrupted run are only in the checkpoint
+    for name in os.listdir(os.path.join(root, "shaders")):
+        shader_id = name[:-5]
+        if name.endswith(".json") and shader_id not in index:
+            with open(os.path.join(root, "shaders", name), encoding="utf-8") as f:
+                index[shader_id] = {"date": int(json.load(f)["info"].get("date", 0))}
+
+    _write_archive_index(root, index)
+
+    if args.assets:
+        from st_assets import AssetMirror
+
+        def shaders():
+            for shader_id in index:
+                with open(os.path.join(root, "shaders", shader_id + ".json"), encoding="utf-8") as f:
+                    yield json.load(f)
+
+        # Download with the session's HTTPTransport too if there is one, so requests is not imported
+        assets = AssetMirror(os.path.join(root, "assets"), session.base_url, session._transport)
+        report = assets.mirror(shaders(), args.workers)
+        assets.close()
+        if not args.quiet:
+            sys.stderr.write("assets: {} fetched, {} cached, {} failed\n".format(
+                report["fetched"], report["cached"], len(report["failed"])
+            ))
+
+        failed += len(report["failed"])
+
+    return failed
+
+def _playlist(session, args):
+    """ Runs the playlist subcommands for main(). """
+    if args.action == "list":
+        output = open(args.target, "w", encoding="utf-8") if args.target else sys.stdout
+        for shader_id in session.get_shaders_in_playlist(args.playlist_id, workers=args.workers):
+            output.write(shader_id + "\n")
+
+        if args.target:
+            output.close()
+
+        return 0
+
+    if args.action == "export":
+        if not args.target:
+            raise SystemExit("playlist export needs an output file")
+
+        return _export(session, args, args.target,
+                       lambda: session.get_shaders_in_playlist(args.playlist_id, workers=args.workers))
+
+    if not args.target:
+        raise SystemExit("playlist {} needs a file of shader IDs".format(args.action))
+
+    with open(args.target, encoding="utf-8") as f:
+        shader_ids = [line.strip() for line in f if line.strip()]
+
+    # Edits already made are skipped by MutationQueue, so running again resumes
+    progress = _Progress(args.action, len(shader_ids), quiet=args.quiet)
+    failed = 0
+    for i in range(0, len(shader_ids), args.batch_size):
+        mutations = MutationQueue(session)
+        for shader_id in shader_ids[i:i + args.batch_size]:
+            if args.action == "add":
+                mutations.add_to_playlist(shader_id, args.playlist_id)
+            else:
+                mutations.remove_from_playlist(shader_id, args.playlist_id)
+
+        results = mutations.flush(args.workers)
+        failed += sum(not result["ok"] for result in results)
+        progress.update(len(results))
+
+    return failed
+
+def main(argv=None):
+    """
+    Command-line interface, run with python -m st_xapi. Signs in with the
+    SHADERTOY_USERNAME and SHADERTOY_PASSWORD environment variables, or
+    restores the signin saved in the --state file (SHADERTOY_STATE), signing
+    in again with the variables if it has expired.
+    Interrupted exports and mirrors resume from their checkpoint when run
+    again with the same arguments.
+
+        python -m st_xapi export shaders.ndjson --workers 8
+        python -m st_xapi mirror archive --ids ids.txt --assets
+        python -m st_xapi playlist list <playlist id> ids.txt
+        python -m st_xapi playlist export <playlist id> playlist.ndjson
+        python -m st_xapi playlist add <playlist id> ids.txt
+
+    Exits with status 1 if anything failed.
+    """
+
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m st_xapi", description="Export and manage shadertoy shaders.")
+    parser.add_argument("--workers", type=int, default=4, help="parallel requests")
+    parser.add_argument("--batch-size", type=int, default=50, help="shaders per request or per flush")
+    parser.add_argument("--state", default=os.environ.get("SHADERTOY_STATE"), help="file to keep the signin in")
+    parser.add_argument("--base-url", default="https://www.shadertoy.com", help=argparse.SUPPRESS)
+    parser.add_argument("--transport", choices=["requests", "http"], default="requests",
+                        help="send requests with requests or with http.client, which starts faster")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints and start over")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="export shaders to newline delimited JSON")
+    export.add_argument("output", help="NDJSON file to write")
+
+    mirror = commands.add_parser("mirror", help="mirror shaders into an archive directory")
+    mirror.add_argument("root", help="archive directory")
+    mirror.add_argument("--assets", action="store_true", help="also mirror the media used as inputs")
+
+    for command in (export, mirror):
+        command.add_argument("--ids", help="file of shader IDs, one per line, instead of all your shaders")
+        command.add_argument("--public", action="store_true", help="only your public shaders")
+
+    playlist = commands.add_parser("playlist", help="list, export or edit a playlist")
+    playlist.add_argument("action", choices=["list", "export", "add", "remove"])
+    playlist.add_argument("playlist_id")
+    playlist.add_argument("target", nargs="?", help="output file, or file of shader IDs to add or remove")
+
+    args = parser.parse_args(argv)
+
+    transport = HTTPTransport() if args.transport == "http" else None
+    session = ShadertoySession(pool_size=args.workers, base_url=args.base_url, transport=transport)
+    username = os.environ.get("SHADERTOY_USERNAME")
+    password = os.environ.get("SHADERTOY_PASSWORD")
+    restored = args.state and session.load_state(args.state, username, password)
+    if not restored and username and password:
+        session.signin(username, password)
+
+    def list_ids():
+        if args.ids:
+            with open(args.ids, encoding="utf-8") as f:
+                return [line.strip() for line in f if line.strip()]
+
+        return session.get_all_shaders(args.public)
+
+    def run():
+        if args.command == "export":
+            return _export(session, args, args.output, list_ids)
+
+        if args.command == "mirror":
+            return _mirror(session, args, args.root, list_ids)
+
+        return _playlist(session, args)
+
+    try:
+        try:
+            failed = run()
+        except ShadertoyError as e:
+            # The restored signin may have expired, in which case sign in again and resume
+            if not restored or e.code not in (ErrorCode.OPERATION_FAILED, ErrorCode.SESSION_EXPIRED) or \
+                    not session._reauthenticate():
+                raise
+
+            failed = run()
+
+    except (ShadertoyError, OSError, ValueError) as e:
+        sys.stderr.write("error: {}\n".format(e))
+        failed = 1
+
+    except KeyboardInterrupt:
+        sys.stderr.write("\ninterrupted, run again to resume\n")
+        failed = 1
+
+    finally:
+        session.close()
+        if transport:
+            transport.close()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Offline tests of st_pages and the scraping in st_xapi built on it, run with
+python -m pytest from this directory.
+"""
+
+from st_fakeserver import FakeShadertoyServer
+from st_pages import PageParser
+from st_xapi import ShadertoySession
+
+def parse(html, variables=(), size=5):
+    parser = PageParser(variables)
+    for i in range(0, len(html), size):
+        parser.feed(html[i:i + size])
+
+    parser.close()
+    return parser
+
+def test_page_parser_arrays():
+    html = """
+        <script>var other = ["x"];</script>
+        <script>
+            var gShaderIDs = ["XsX3RB", 'Md23DV',
+                              "4dXGR4"];
+        </script>
+    """
+
+    parser = parse(html, ["gShaderIDs", "missing"])
+    assert parser.arrays == {"gShaderIDs": ["XsX3RB", "Md23DV", "4dXGR4"]}
+
+def test_page_parser_tables():
+    html = """
+        <table>
+            <thead><tr><td>Name</td><td>Key</td></tr></thead>
+            <tr><td> my  app </td><td>abc</td></tr>
+            <tr><th>Row title</th><td>def</td></tr>
+        </table>
+    """
+
+    parser = parse(html)
+    assert parser.header == ["Name", "Key"]
+    assert parser.rows == [["my app", "abc"], ["Row title", "def"]]
+
+def test_page_parser_th_header():
+    parser = parse("<table><tr><th>Name</th><th>Key</th></tr><tr><td>app</td><td>abc</td></tr></table>")
+    assert parser.header == ["Name", "Key"]
+    assert parser.rows == [["app", "abc"]]
+
+def test_playlist_pages():
+    with FakeShadertoyServer(num_shaders=50) as server:
+        session = ShadertoySession(base_url=server.url)
+        session.signin(server.username, server.password)
+        playlist_id = session.create_playlist("test", "")
+        for shader_id in server.owned[:25]:
+            assert session.add_shader_to_playlist(shader_id, playlist_id)
+
+        assert session.get_shaders_in_playlist(playlist_id, page_size=10) == server.owned[:25]
+        shaders = session.get_shaders_in_playlist(playlist_id, page_size=10, fetch_shaders=True)
+        assert [shader["info"]["id"] for shader in shaders] == server.owned[:25]
+
+        # A server ignoring the page offset repeats the first page, which must not loop forever
+        playlist_page = server.playlist_page
+        server.playlist_page = lambda playlist_id, query: playlist_page(playlist_id, {"num": query["num"]})
+        assert session.get_shaders_in_playlist(playlist_id, page_size=10) == server.owned[:10]
+        session.close()
+
+def test_apps_page():
+    with FakeShadertoyServer() as server:
+        session = ShadertoySession(base_url=server.url)
+        session.signin(server.username, server.password)
+        session.create_app("test app", "description")
+        assert [app["name"] for app in session.get_apps()] == ["test app"]
+        session.close()
@@ -0,0 +1,389 @@
+"""
+Offline tests of st_xapi, run with python -m pytest from this directory.
+Sessions and the CLI are driven against an st_fakeserver.FakeShadertoyServer.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from st_fakeserver import FakeShadertoyServer
+from st_xapi import (
+    ErrorCode, HTTPTransport, MutationQueue, RecordingTransport, ReplayTransport, ResponseMemo, SessionPool,
+    ShaderCache, ShadertoyError, ShadertoySession, Watcher, iter_json_array, main
+)
+
+@pytest.fixture
+def server(monkeypatch):
+    with FakeShadertoyServer(num_shaders=120, payload_size=256) as server:
+        monkeypatch.setenv("SHADERTOY_USERNAME", server.username)
+        monkeypatch.setenv("SHADERTOY_PASSWORD", server.password)
+        yield server
+
+def run(server, *argv):
+    """ Runs the CLI against server and returns its exit status. """
+    with pytest.raises(SystemExit) as exit_info:
+        main(["--base-url", server.url, "--quiet", "--workers", "4", "--batch-size", "7"] + list(argv))
+
+    return exit_info.value.code
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_iter_json_array(size):
+    elements = [{"id": "XsX3RB", "name": "café ☃"}, 12345.678, -1e10, "a, ]b", [1, [2]], True, None]
+    data = (" \n\t" + json.dumps(elements, ensure_ascii=False) + " \n").encode("utf-8")
+    assert list(iter_json_array(chunked(data, size))) == elements
+
+def test_iter_json_array_empty():
+    assert list(iter_json_array([b" [", b" ]"])) == []
+
+def test_iter_json_array_numbers_across_chunks():
+    assert list(iter_json_array([b"[12", b"34,5", b"6]"])) == [1234, 56]
+
+def test_iter_json_array_large_element():
+    # Many chunks per element, which must not be decoded again with each of them
+    elements = [{"code": "x\\n" * 100000}, 1, {"code": "y" * 300000}]
+    data = json.dumps(elements).encode("utf-8")
+    assert list(iter_json_array(chunked(data, 4096))) == elements
+
+def test_iter_json_array_invalid():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b"{\"a\": 1}"]))
+
+    with pytest.raises(ValueError):
+        list(iter_json_array([b"[1, 2"]))
+
+    with pytest.raises(ValueError):
+        list(iter_json_array([]))
+
+def test_export(server, tmp_path):
+    output = str(tmp_path / "shaders.ndjson")
+    assert run(server, "export", output) == 0
+
+    with open(output, encoding="utf-8") as f:
+        ids = [json.loads(line)["info"]["id"] for line in f]
+
+    assert sorted(ids) == sorted(server.owned)
+    assert not os.path.exists(output + ".checkpoint")
+
+def test_export_resume(server, tmp_path):
+    output = str(tmp_path / "shaders.ndjson")
+
+    # Non-transient errors aren't retried, so batches fail and are left to the next run
+    server.error_status = 400
+    for error_rate in (0.3, 0.4, 0.5):
+        server.error_rate = error_rate
+        run(server, "export", output)
+
+    server.error_rate = 0
+    assert run(server, "export", output) == 0
+
+    with open(output, encoding="utf-8") as f:
+        ids = [json.loads(line)["info"]["id"] for line in f]
+
+    assert len(ids) == len(set(ids))
+    assert sorted(ids) == sorted(server.owned)
+    assert not os.path.exists(output + ".checkpoint")
+
+def test_export_restart(server, tmp_path):
+    output = str(tmp_path / "shaders.ndjson")
+    assert run(server, "export", output) == 0
+    assert run(server, "--restart", "export", output) == 0
+
+    with open(output, encoding="utf-8") as f:
+        assert len(f.readlines()) == len(server.owned)
+
+def test_retries(server):
+    session = ShadertoySession(base_url=server.url, backoff=0)
+    session.signin(server.username, server.password)
+    server.error_rate = 1
+    server.error_status = 502
+
+    # Reads are retried, but an upload may have been saved before the gateway error
+    requests = server.requests
+    with pytest.raises(ValueError):
+        session.get_all_shaders()
+
+    assert server.requests - requests == session.max_retries + 1
+
+    requests = server.requests
+    with pytest.raises(ValueError):
+        session.upload_shader(server.generate_shader("new"))
+
+    assert server.requests - requests == 1
+    session.close()
+
+def test_mutation_queue(server):
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    shader_id = server.owned[0]
+    playlist_id = session.create_playlist("test", "")
+    assert session.add_shader_to_playlist(shader_id, playlist_id)
+
+    # The last operation on a target wins, the earlier one is reported as elided
+    mutations = MutationQueue(session)
+    mutations.add_to_playlist(shader_id, playlist_id)
+    mutations.remove_from_playlist(shader_id, playlist_id)
+    mutations.like(shader_id)
+    mutations.like(shader_id, False)
+    mutations.like(shader_id)
+    results = mutations.flush()
+
+    assert [(result["kind"], result["value"], result["elided"]) for result in results] == [
+        ("playlist", True, True), ("playlist", False, False), ("like", True, True), ("like", False, True),
+        ("like", True, False)
+    ]
+    assert all(result["ok"] for result in results)
+    assert mutations.elided == 3
+    stats = session.get_shader_playlist_stats(shader_id)
+    assert not dict(zip(stats["id"], stats["exists"]))[playlist_id]
+
+    # Edits which change nothing are skipped
+    mutations.remove_from_playlist(shader_id, playlist_id)
+    assert mutations.flush()[0]["skipped"]
+    session.close()
+
+def test_mirror(server, tmp_path):
+    root = str(tmp_path / "archive")
+    assert run(server, "mirror", root) == 0
+    assert len(os.listdir(os.path.join(root, "shaders"))) == len(server.owned)
+
+    # Only new shaders are fetched and removed ones are tombstoned
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    deleted_id = server.owned[0]
+    assert session.delete_shader(deleted_id)
+    session.close()
+
+    requests = server.requests
+    assert run(server, "mirror", root) == 0
+    assert server.requests - requests <= 2
+
+    with open(os.path.join(root, "index.json"), encoding="utf-8") as f:
+        index = json.load(f)
+
+    assert [shader_id for shader_id, entry in index.items() if entry.get("deleted")] == [deleted_id]
+    assert os.path.exists(os.path.join(root, "shaders", deleted_id + ".json"))
+
+def test_expired_state(server, tmp_path):
+    state = str(tmp_path / "state.json")
+    output = str(tmp_path / "shaders.ndjson")
+    assert run(server, "--state", state, "export", output) == 0
+
+    # Sign in again if the saved session has expired
+    server.tokens.clear()
+    assert run(server, "--state", state, "export", output) == 0
+    assert server.tokens
+
+def test_mirror_assets_without_requests(server, tmp_path):
+    root = str(tmp_path / "archive")
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    shader = server.generate_shader("new")
+    shader["renderpass"][0]["inputs"] = [{"id": 1, "type": "texture", "filepath": "/media/a/noise.png"}]
+    session.upload_shader(shader)
+    session.close()
+
+    script = (
+        "import sys, st_xapi\n"
+        "try:\n"
+        "    st_xapi.main(sys.argv[1:])\n"
+        "finally:\n"
+        "    assert 'requests' not in sys.modules and 'html.parser' not in sys.modules\n"
+    )
+
+    env = dict(os.environ, SHADERTOY_USERNAME=server.username, SHADERTOY_PASSWORD=server.password)
+    process = subprocess.run([
+        sys.executable, "-c", script, "--base-url", server.url, "--transport", "http", "--quiet", "mirror", root,
+        "--assets"
+    ], env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert process.returncode == 0
+    with open(os.path.join(root, "assets", "paths.json"), encoding="utf-8") as f:
+        assert list(json.load(f)) == ["/media/a/noise.png"]
+
+def test_cassette(server, tmp_path):
+    cassette = str(tmp_path / "crawl.cassette")
+    session = ShadertoySession(base_url=server.url)
+    session.transport = RecordingTransport(session.session, cassette)
+    session.signin(server.username, server.password)
+    shader_ids = session.get_all_shaders()
+    shaders = session.get_shaders_bulk(shader_ids, batch_size=10, workers=4)[0]
+
+    # Workers record through their own requests.Session to the same cassette
+    member = session.clone()
+    assert member.transport.inner is member.session
+    assert member.transport.lock is session.transport.lock
+    assert member.cookies is session.cookies
+    session.close()
+
+    requests = server.requests
+    session = ShadertoySession(base_url=server.url, transport=ReplayTransport(cassette))
+    session.signin(server.username, server.password)
+    assert session.get_all_shaders() == shader_ids
+    assert session.get_shaders_bulk(shader_ids, batch_size=10, workers=4)[0] == shaders
+    assert server.requests == requests
+
+def test_cassette_cookies(server, tmp_path):
+    state = str(tmp_path / "state.json")
+    transport = HTTPTransport()
+    session = ShadertoySession(base_url=server.url, transport=RecordingTransport(transport, str(tmp_path / "cassette")))
+    session.signin(server.username, server.password)
+    session.save_state(state)
+
+    # The cookies saved are those of the wrapped transport
+    assert session.cookies is transport.cookies
+    restored = ShadertoySession(base_url=server.url, transport=HTTPTransport())
+    assert restored.load_state(state)
+    assert restored.get_all_shaders() == server.owned
+    transport.close()
+    restored.transport.close()
+
+def test_watcher_errors(server):
+    session = ShadertoySession(base_url=server.url, backoff=0)
+    session.signin(server.username, server.password)
+    shader_id = server.owned[0]
+    watcher = Watcher(session, shader_id, min_interval=0.01, max_interval=0.05)
+    events = []
+    stop = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(events.append, stop))
+    thread.start()
+
+    # Failed polls back off and the watcher carries on once the server recovers
+    time.sleep(0.1)
+    server.error_status = 400
+    server.error_rate = 1
+    time.sleep(0.2)
+    assert watcher.errors and watcher.interval > watcher.min_interval
+
+    server.error_rate = 0
+    assert session.post_comment(shader_id, "hello")
+    deadline = time.time() + 5
+    while not events and time.time() < deadline:
+        time.sleep(0.01)
+
+    stop.set()
+    thread.join()
+    assert [event["data"]["text"] for event in events] == ["hello"]
+    session.close()
+
+def test_sync_archive(server, tmp_path):
+    root = str(tmp_path / "archive")
+    session = ShadertoySession(base_url=server.url)
+    session.signin(server.username, server.password)
+    assert session.sync_archive(root)["fetched"] == len(server.owned)
+    assert sorted(os.listdir(os.path.join(root, "shaders"))) == sorted(i + ".json" for i in server.owned)
+
+    assert session.delete_shader(server.owned[0])
+    report = session.sync_archive(root)
+    assert (report["fetched"], report["skipped"], report["deleted"]) == (0, len(server.owned), 1)
+    session.close()
+
+def test_shader_cache(server, tmp_path):
+    cache = ShaderCache(str(tmp_path / "cache.db"), max_entries=20)
+    session = ShadertoySession(base_url=server.url, cache=cache)
+    session.signin(server.username, server.password)
+    shader_ids = server.owned[:10]
+    shaders = session.get_shaders(shader_ids)
+
+    requests = server.requests
+    assert session.get_shaders(shader_ids) == shaders
+    assert server.requests == requests
+
+    # Shaders are fetched again once a newer revision is known
+    date = int(shaders[0]["info"]["date"])
+    assert session.get_shaders(shader_ids, revisions={shader_ids[0]: date + 1}) == shaders
+    assert server.requests == requests + 1
+    assert cache.stats()["stale"] == 1
+
+    # And once updated through the session
+    shader = dict(shaders[1], info=dict(shaders[1]["info"], name="renamed"))
+    assert session.upload_shader(shader, is_update=True) == shader_ids[1]
+    assert session.get_shaders([shader_ids[1]])[0]["info"]["name"] == "renamed"
+
+    # The least recently used shaders are evicted first
+    session.get_shaders(shader_ids[5:])
+    session.get_shaders(server.owned[10:25])
+    assert cache.stats()["size"] == 20
+    assert cache.stats()["evictions"] == 5
+    assert {row[0] for row in cache.db.execute("SELECT id FROM shaders")} == set(server.owned[5:25])
+    session.close()
+    cache.close()
+
+def test_response_memo(server):
+    memo = ResponseMemo()
+    session = ShadertoySession(base_url=server.url, memo=memo)
+    session.signin(server.username, server.password)
+    shader_ids = server.owned[:5]
+
+    # Identical reads in flight at the same time share one request
+    server.latency = 0.2
+    requests = server.requests
+    members = [session.clone() for _ in range(8)]
+    threads = [threading.Thread(target=member.get_shaders, args=(shader_ids,)) for member in members]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    server.latency = 0
+    assert server.requests == requests + 1
+    assert (memo.misses, memo.coalesced) == (1, 7)
+
+    session.get_shaders(shader_ids)
+    assert server.requests == requests + 1
+    assert memo.hits == 1
+
+    # Liking another shader leaves the response, liking one of these drops it
+    assert session.set_shader_like(server.owned[10])
+    session.get_shaders(shader_ids)
+    assert server.requests == requests + 2
+
+    assert session.set_shader_like(shader_ids[0])
+    session.get_shaders(shader_ids)
+    assert server.requests == requests + 4
+    session.close()
+
+def test_session_pool(server):
+    accounts = [(server.username, server.password)] * 2
+    with SessionPool(accounts, sessions_per_account=2, base_url=server.url) as pool:
+        assert len(pool) == 4
+        assert [error for _, error in pool.map(lambda session, item: session.get_all_shaders(), range(8))] == [None] * 8
+
+        # An account whose signin expired is signed in again before its sessions are used
+        server.tokens.clear()
+        for session in [pool.acquire() for _ in range(len(pool))]:
+            pool.release(session, ShadertoyError(ErrorCode.SESSION_EXPIRED))
+
+        assert [error for _, error in pool.map(lambda session, item: session.get_all_shaders(), range(8))] == [None] * 8
+        assert len(server.tokens) == 2
+
+        # Accounts which reached their daily quota are passed over until it resets
+        with pytest.raises(ShadertoyError):
+            with pool.session() as session:
+                raise ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED)
+
+        exhausted = [account for account in pool.accounts if account["exhausted"]]
+        assert len(exhausted) == 1
+        for _ in range(4):
+            with pool.session() as session:
+                assert pool.owners[id(session)] is not exhausted[0]
+
+        results = pool.map(lambda session, item: session.upload_shader(server.generate_shader("new")), range(4))
+        assert all(error is None for _, error in results)
+
+        with pytest.raises(ShadertoyError):
+            with pool.session() as session:
+                raise ShadertoyError(ErrorCode.DAILY_QUOTA_REACHED)
+
+        with pytest.raises(ShadertoyError) as error_info:
+            pool.acquire()
+
+        assert error_info.value.code == ErrorCode.DAILY_QUOTA_REACHED